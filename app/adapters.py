@@ -0,0 +1,236 @@
+# Domain adapters: everything domain-specific about generic property sets in one place.
+# DOMAIN_SERVICE_MAP, the capability index and the properties view are all derived from them.
+from typing import Any, Dict, Optional, Tuple
+
+class DomainAdapter:
+    domain = ""
+    # property -> (domain, service, mapper); the mapper returns service data, or a
+    # (domain, service, data) tuple to redirect (e.g. on=False -> turn_off)
+    services: Dict[str, Tuple[str, str, Any]] = {}
+    # property -> service field the HA schema must list (None: the service alone is enough)
+    fields: Dict[str, Optional[str]] = {}
+    # attributes capabilities() depends on; other attribute changes keep compiled entries valid
+    feature_attrs: Tuple[str, ...] = ("supported_features",)
+    # service -> service of the same domain that also accepts its data; folded into it when both are planned
+    folds: Dict[str, str] = {}
+    # toggle/mode properties: their calls run first, one at a time in services order; the
+    # remaining calls (e.g. volume_set + select_source) then run concurrently
+    leading: Tuple[str, ...] = ()
+
+    def capabilities(self, attrs: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        """property -> {type, min/max/options} for what this entity supports."""
+        return {}
+
+    def read(self, entity: Dict[str, Any], caps: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        """Current value of each capability; by default the attribute of the same name."""
+        attrs = entity["attributes"] or {}
+        return {p: attrs[p] for p in caps if p in attrs}
+
+ADAPTERS: Dict[str, DomainAdapter] = {}
+
+def register(cls):
+    """Class decorator adding an adapter to the registry (one per domain)."""
+    ADAPTERS[cls.domain] = cls()
+    return cls
+
+def _toggle(domain: str, on: str = "turn_on", off: str = "turn_off"):
+    return (domain, on, lambda v: {} if v else (domain, off, {}))
+
+def _features(attrs: Dict[str, Any]) -> int:
+    return attrs.get("supported_features") or 0
+
+@register
+class LightAdapter(DomainAdapter):
+    domain = "light"
+    services = {
+        "on": _toggle("light"),
+        "brightness": ("light", "turn_on", lambda v: {"brightness": int(v)}),
+        "color_temp": ("light", "turn_on", lambda v: {"color_temp": int(v)}),
+        "hs_color": ("light", "turn_on", lambda v: {"hs_color": v}),
+    }
+    leading = ("on",)
+    fields = {"on": None, "brightness": "brightness", "color_temp": "color_temp", "hs_color": "hs_color"}
+    feature_attrs = ("supported_features", "supported_color_modes", "min_mireds", "max_mireds")
+    # HA color modes implying each property, and the legacy supported_features bits
+    BRIGHTNESS_MODES = {"brightness", "color_temp", "hs", "xy", "rgb", "rgbw", "rgbww", "white"}
+    COLOR_MODES = {"hs", "xy", "rgb", "rgbw", "rgbww"}
+    SUPPORT_BRIGHTNESS, SUPPORT_COLOR_TEMP, SUPPORT_COLOR = 1, 2, 16
+
+    def capabilities(self, attrs):
+        modes = set(attrs.get("supported_color_modes") or ())
+        feats = _features(attrs)
+        caps = {"on": {"type": "bool"}}
+        if modes & self.BRIGHTNESS_MODES or feats & self.SUPPORT_BRIGHTNESS:
+            caps["brightness"] = {"type": "int", "min": 0, "max": 255}
+        if "color_temp" in modes or feats & self.SUPPORT_COLOR_TEMP:
+            caps["color_temp"] = {"type": "int", "min": attrs.get("min_mireds"), "max": attrs.get("max_mireds")}
+        if modes & self.COLOR_MODES or feats & self.SUPPORT_COLOR:
+            caps["hs_color"] = {"type": "hs"}
+        return caps
+
+    def read(self, entity, caps):
+        return {"on": entity["state"] != "off", **super().read(entity, caps)}
+
+@register
+class SwitchAdapter(DomainAdapter):
+    domain = "switch"
+    services = {"on": _toggle("switch")}
+    leading = ("on",)
+    fields = {"on": None}
+
+    def capabilities(self, attrs):
+        return {"on": {"type": "bool"}}
+
+    def read(self, entity, caps):
+        return {"on": entity["state"] == "on"}
+
+@register
+class ClimateAdapter(DomainAdapter):
+    domain = "climate"
+    services = {
+        "hvac_mode": ("climate", "set_hvac_mode", lambda v: {"hvac_mode": v}),
+        "temperature": ("climate", "set_temperature", lambda v: {"temperature": float(v)}),
+        "fan_mode": ("climate", "set_fan_mode", lambda v: {"fan_mode": v}),
+    }
+    fields = {"hvac_mode": "hvac_mode", "temperature": "temperature", "fan_mode": "fan_mode"}
+    feature_attrs = ("supported_features", "hvac_modes", "fan_modes", "min_temp", "max_temp")
+    folds = {"set_hvac_mode": "set_temperature"}
+    leading = ("hvac_mode",)
+    SUPPORT_TARGET_TEMPERATURE, SUPPORT_FAN_MODE = 1, 8
+
+    def capabilities(self, attrs):
+        feats = _features(attrs)
+        caps: Dict[str, Dict[str, Any]] = {}
+        if attrs.get("hvac_modes"):
+            caps["hvac_mode"] = {"type": "enum", "options": list(attrs["hvac_modes"])}
+        if feats & self.SUPPORT_TARGET_TEMPERATURE:
+            caps["temperature"] = {"type": "float", "min": attrs.get("min_temp"), "max": attrs.get("max_temp")}
+        if feats & self.SUPPORT_FAN_MODE or attrs.get("fan_modes"):
+            caps["fan_mode"] = {"type": "enum", "options": list(attrs.get("fan_modes") or ()) or None}
+        return caps
+
+    def read(self, entity, caps):
+        values = super().read(entity, caps)
+        if "hvac_mode" in caps:
+            values["hvac_mode"] = entity["state"]  # HA reports the mode as the state
+        return values
+
+@register
+class CoverAdapter(DomainAdapter):
+    domain = "cover"
+    services = {
+        "open": _toggle("cover", "open_cover", "close_cover"),
+        "position": ("cover", "set_cover_position", lambda v: {"position": int(v)}),
+        "tilt_position": ("cover", "set_cover_tilt_position", lambda v: {"tilt_position": int(v)}),
+    }
+    fields = {"open": None, "position": "position", "tilt_position": "tilt_position"}
+    leading = ("open",)
+    SUPPORT_OPEN, SUPPORT_SET_POSITION, SUPPORT_SET_TILT_POSITION = 1, 4, 128
+
+    def capabilities(self, attrs):
+        feats = _features(attrs)
+        caps: Dict[str, Dict[str, Any]] = {}
+        if feats & self.SUPPORT_OPEN:
+            caps["open"] = {"type": "bool"}
+        if feats & self.SUPPORT_SET_POSITION:
+            caps["position"] = {"type": "int", "min": 0, "max": 100}
+        if feats & self.SUPPORT_SET_TILT_POSITION:
+            caps["tilt_position"] = {"type": "int", "min": 0, "max": 100}
+        return caps
+
+    def read(self, entity, caps):
+        attrs = entity["attributes"] or {}
+        values: Dict[str, Any] = {}
+        if "open" in caps:
+            values["open"] = entity["state"] in ("open", "opening")
+        if "position" in caps and "current_position" in attrs:
+            values["position"] = attrs["current_position"]
+        if "tilt_position" in caps and "current_tilt_position" in attrs:
+            values["tilt_position"] = attrs["current_tilt_position"]
+        return values
+
+@register
+class FanAdapter(DomainAdapter):
+    domain = "fan"
+    services = {
+        "on": _toggle("fan"),
+        "percentage": ("fan", "set_percentage", lambda v: {"percentage": int(v)}),
+        "preset_mode": ("fan", "set_preset_mode", lambda v: {"preset_mode": v}),
+        "oscillating": ("fan", "oscillate", lambda v: {"oscillating": bool(v)}),
+        "direction": ("fan", "set_direction", lambda v: {"direction": v}),
+    }
+    fields = {"on": None, "percentage": "percentage", "preset_mode": "preset_mode",
+              "oscillating": "oscillating", "direction": "direction"}
+    feature_attrs = ("supported_features", "preset_modes")
+    folds = {"set_percentage": "turn_on", "set_preset_mode": "turn_on"}
+    leading = ("on",)
+    SUPPORT_SET_SPEED, SUPPORT_OSCILLATE, SUPPORT_DIRECTION, SUPPORT_PRESET_MODE = 1, 2, 4, 8
+
+    def capabilities(self, attrs):
+        feats = _features(attrs)
+        caps = {"on": {"type": "bool"}}
+        if feats & self.SUPPORT_SET_SPEED:
+            caps["percentage"] = {"type": "int", "min": 0, "max": 100}
+        if feats & self.SUPPORT_PRESET_MODE:
+            caps["preset_mode"] = {"type": "enum", "options": list(attrs.get("preset_modes") or ()) or None}
+        if feats & self.SUPPORT_OSCILLATE:
+            caps["oscillating"] = {"type": "bool"}
+        if feats & self.SUPPORT_DIRECTION:
+            caps["direction"] = {"type": "enum", "options": ["forward", "reverse"]}
+        return caps
+
+    def read(self, entity, caps):
+        return {"on": entity["state"] == "on", **super().read(entity, caps)}
+
+@register
+class MediaPlayerAdapter(DomainAdapter):
+    domain = "media_player"
+    services = {
+        "on": _toggle("media_player"),
+        "playing": _toggle("media_player", "media_play", "media_pause"),
+        "volume_level": ("media_player", "volume_set", lambda v: {"volume_level": float(v)}),
+        "is_volume_muted": ("media_player", "volume_mute", lambda v: {"is_volume_muted": bool(v)}),
+        "source": ("media_player", "select_source", lambda v: {"source": v}),
+    }
+    fields = {"on": None, "playing": None, "volume_level": "volume_level",
+              "is_volume_muted": "is_volume_muted", "source": "source"}
+    feature_attrs = ("supported_features", "source_list")
+    leading = ("on", "playing")
+    SUPPORT_PAUSE, SUPPORT_VOLUME_SET, SUPPORT_VOLUME_MUTE = 1, 4, 8
+    SUPPORT_TURN_ON, SUPPORT_TURN_OFF, SUPPORT_SELECT_SOURCE, SUPPORT_PLAY = 128, 256, 2048, 16384
+
+    def capabilities(self, attrs):
+        feats = _features(attrs)
+        caps: Dict[str, Dict[str, Any]] = {}
+        if feats & self.SUPPORT_TURN_ON and feats & self.SUPPORT_TURN_OFF:
+            caps["on"] = {"type": "bool"}
+        if feats & self.SUPPORT_PLAY and feats & self.SUPPORT_PAUSE:
+            caps["playing"] = {"type": "bool"}
+        if feats & self.SUPPORT_VOLUME_SET:
+            caps["volume_level"] = {"type": "float", "min": 0, "max": 1}
+        if feats & self.SUPPORT_VOLUME_MUTE:
+            caps["is_volume_muted"] = {"type": "bool"}
+        if feats & self.SUPPORT_SELECT_SOURCE:
+            caps["source"] = {"type": "enum", "options": list(attrs.get("source_list") or ()) or None}
+        return caps
+
+    def read(self, entity, caps):
+        values = super().read(entity, caps)
+        if "on" in caps:
+            values["on"] = entity["state"] not in ("off", "unavailable")
+        if "playing" in caps:
+            values["playing"] = entity["state"] == "playing"
+        return values
+
+@register
+class LockAdapter(DomainAdapter):
+    domain = "lock"
+    services = {"locked": _toggle("lock", "lock", "unlock")}
+    leading = ("locked",)
+    fields = {"locked": None}
+
+    def capabilities(self, attrs):
+        return {"locked": {"type": "bool"}}
+
+    def read(self, entity, caps):
+        return {"locked": entity["state"] == "locked"}
@@ -1,12 +1,18 @@
-from fastapi import APIRouter, HTTPException, Query
+import base64, bisect, hashlib, time
+from datetime import datetime
+from collections import OrderedDict
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+import orjson
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
-from sqlalchemy import select
-from sqlalchemy.orm import Session
-from .db import SessionLocal
-from .models import Entity
-from .mappings import DOMAIN_SERVICE_MAP
-from .ha_client import call_service
+from .state import catalog
+from .persist import writer
+from .history import history
+from .audit import audit, query_records, encode_cursor as encode_audit_cursor, decode_cursor as decode_audit_cursor
+from .db import db_worker
+from .commands import run_command, run_batch, CommandError
+from .ha_client import http_stats
 
 router = APIRouter(prefix="/api/v1")
 
@@ -15,93 +21,200 @@ class PropertyRequest(BaseModel):
     properties: Dict[str, Any]
     actor: Optional[str] = "api"
 
+class BatchEntry(BaseModel):
+    entity_id: str
+    properties: Dict[str, Any]
+
+class BatchRequest(BaseModel):
+    commands: List[BatchEntry]
+    actor: Optional[str] = "api"
+
+@router.get("/status/persistence")
+async def persistence_status():
+    return writer.stats()
+
+@router.get("/status/ha")
+async def ha_client_status():
+    return http_stats()
+
+ENTITY_FIELDS = ("entity_id", "domain", "friendly_name", "state", "attributes", "device_id", "area_id")
+
+# (epoch, version, query string) -> encoded body and headers for recent list queries;
+# identical polls between changes skip serialization
+_list_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+_LIST_CACHE_SIZE = 64
+
+def _decode_cursor(cursor: str) -> str:
+    try:
+        return base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(400, "Invalid cursor")
+
+def _encode_cursor(eid: str) -> str:
+    return base64.urlsafe_b64encode(eid.encode()).decode().rstrip("=")
+
 @router.get("/entities")
-def list_entities(q: Optional[str] = None, domain: Optional[str] = None):
-    with SessionLocal() as s:
-        stmt = select(Entity)
-        rows = s.scalars(stmt).all()
-        out = []
-        for e in rows:
-            if q and q.lower() not in (e.id.lower() + " " + (e.friendly_name or "").lower()):
-                continue
-            if domain and e.domain != domain:
-                continue
-            out.append({
-                "entity_id": e.id,
-                "domain": e.domain,
-                "friendly_name": e.friendly_name,
-                "state": e.state,
-                "attributes": e.attributes,
-            })
-        return out
+async def list_entities(
+    request: Request,
+    q: Optional[str] = None,
+    domain: Optional[str] = None,
+    fields: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=10000),
+    cursor: Optional[str] = None,
+):
+    """Entities sorted by entity_id; served on the event loop since it only reads memory.
+    `fields` projects (entity_id is always kept), `limit` + `cursor` paginate (next cursor in
+    X-Next-Cursor), and the strong ETag is derived from the catalog version so unchanged
+    polls get a 304 without any serialization.
+    """
+    query = request.url.query
+    etag = '"%s-%x-%s"' % (catalog.epoch, catalog.version,
+                           hashlib.blake2b(query.encode(), digest_size=16).hexdigest())
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    key = (catalog.epoch, catalog.version, query)
+    cached = _list_cache.get(key)
+    if cached is None:
+        proj = None
+        if fields:
+            proj = ["entity_id"] + [f for f in fields.split(",") if f and f != "entity_id"]
+            unknown = set(proj) - set(ENTITY_FIELDS)
+            if unknown:
+                raise HTTPException(400, f"Unknown fields: {', '.join(sorted(unknown))}")
+        ids = catalog.find(q, domain)
+        start = bisect.bisect_right(ids, _decode_cursor(cursor)) if cursor else 0
+        end = len(ids) if limit is None else start + limit
+        page = ids[start:end]
+        rows = [catalog.entities[eid] for eid in page]
+        if proj:
+            rows = [{k: e[k] for k in proj} for e in rows]
+        headers = {"ETag": etag}
+        if end < len(ids) and page:
+            headers["X-Next-Cursor"] = _encode_cursor(page[-1])
+        cached = (orjson.dumps(rows), headers)
+        _list_cache[key] = cached
+        if len(_list_cache) > _LIST_CACHE_SIZE:
+            _list_cache.popitem(last=False)
+    return Response(cached[0], media_type="application/json", headers=cached[1])
 
 @router.get("/entities/{entity_id}")
-def get_entity(entity_id: str):
-    with SessionLocal() as s:
-        e = s.get(Entity, entity_id)
-        if not e:
-            raise HTTPException(404, "Entity not found")
-        return {
-            "entity_id": e.id,
-            "domain": e.domain,
-            "friendly_name": e.friendly_name,
-            "state": e.state,
-            "attributes": e.attributes,
-        }
+async def get_entity(entity_id: str):
+    e = catalog.get(entity_id)
+    if not e:
+        raise HTTPException(404, "Entity not found")
+    return e
+
+@router.get("/areas")
+async def list_areas():
+    return [{**a, "entity_count": len(catalog.by_area.get(aid, ()))} for aid, a in sorted(catalog.areas.items())]
+
+@router.get("/areas/{area_id}/entities")
+async def area_entities(area_id: str):
+    if area_id not in catalog.areas:
+        raise HTTPException(404, "Area not found")
+    return [catalog.entities[eid] for eid in catalog.in_area(area_id)]
+
+@router.get("/devices")
+async def list_devices(area: Optional[str] = None):
+    return [d for _, d in sorted(catalog.devices.items()) if area is None or d["area_id"] == area]
+
+@router.get("/devices/{device_id}")
+async def get_device(device_id: str):
+    d = catalog.devices.get(device_id)
+    if not d:
+        raise HTTPException(404, "Device not found")
+    return {**d, "entities": [catalog.entities[eid] for eid in catalog.on_device(device_id)]}
+
+@router.get("/properties")
+async def bulk_properties(
+    ids: Optional[List[str]] = Query(None),
+    area: Optional[str] = None,
+    domain: Optional[str] = None,
+):
+    """Properties of many entities in one pass (e.g. every tile of a dashboard): explicit `ids`
+    (repeated or comma-separated), and/or everything in an `area` and/or `domain`.
+    """
+    wanted = [v for raw in ids or () for v in raw.split(",") if v]
+    if not wanted and area is None and domain is None:
+        raise HTTPException(400, "Pass ids, area or domain")
+    if wanted:
+        missing = [eid for eid in wanted if eid not in catalog.entities]
+        selected = [eid for eid in wanted if eid in catalog.entities]
+    else:
+        missing = []
+        selected = catalog.in_area(area) if area is not None else catalog.find(domain=domain)
+    if domain is not None:
+        selected = [eid for eid in selected if eid.split(".", 1)[0] == domain]
+    if area is not None and wanted:
+        selected = [eid for eid in selected if catalog.entities[eid]["area_id"] == area]
+    items = [catalog.capabilities.view(catalog.entities[eid]) for eid in selected]
+    if not wanted:
+        items = [i for i in items if i["capabilities"]]
+    return Response(orjson.dumps({"items": items, "missing": missing}), media_type="application/json")
 
 @router.get("/properties/{entity_id}")
-def get_adjustable_properties(entity_id: str):
-    """Return a generic view of adjustable properties based on domain + attributes.
-    This is heuristic; extend per your devices.
+async def get_adjustable_properties(entity_id: str):
+    """Current values of the properties this entity can set, plus their capabilities
+    (type, range/options, service) from the service schemas and supported features.
     """
-    with SessionLocal() as s:
-        e = s.get(Entity, entity_id)
-        if not e:
-            raise HTTPException(404, "Entity not found")
-        props = {}
-        if e.domain == "light":
-            props["on"] = e.state != "off"
-            if "brightness" in (e.attributes or {}):
-                props["brightness"] = e.attributes.get("brightness")
-            if "color_temp" in (e.attributes or {}):
-                props["color_temp"] = e.attributes.get("color_temp")
-            if "hs_color" in (e.attributes or {}):
-                props["hs_color"] = e.attributes.get("hs_color")
-        elif e.domain == "switch":
-            props["on"] = e.state == "on"
-        elif e.domain == "climate":
-            for k in ("hvac_mode","temperature","fan_mode"):
-                if k in (e.attributes or {}):
-                    props[k] = e.attributes.get(k)
-        # add more domains as needed
-        return {"entity_id": e.id, "domain": e.domain, "properties": props}
+    e = catalog.get(entity_id)
+    if not e:
+        raise HTTPException(404, "Entity not found")
+    return catalog.capabilities.view(e)
+
+@router.get("/history/{entity_id}")
+async def get_history(
+    entity_id: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    resolution: Optional[str] = Query(None, pattern="^(raw|1m|1h|1d)$"),
+):
+    """Numeric history; without `resolution` the coarsest fitting one is picked (raw up to 6h,
+    1m up to 2d, 1h up to 60d, else 1d). Defaults to the last 24h.
+    """
+    end_ts = end.timestamp() if end else time.time()
+    start_ts = start.timestamp() if start else end_ts - 86400
+    if start_ts >= end_ts:
+        raise HTTPException(400, "start must be before end")
+    body = await history.query(entity_id, start_ts, end_ts, resolution)
+    return Response(orjson.dumps(body), media_type="application/json")
 
 @router.post("/command")
 async def set_properties(req: PropertyRequest):
-    # Determine domain
-    domain = req.entity_id.split(".",1)[0]
-    if domain not in DOMAIN_SERVICE_MAP:
-        raise HTTPException(400, f"Domain {domain} not supported for generic set")
-
-    # Accumulate service calls
-    calls = []
-    mapping = DOMAIN_SERVICE_MAP[domain]
-    for prop, value in req.properties.items():
-        if prop not in mapping:
-            raise HTTPException(400, f"Property {prop} not supported for domain {domain}")
-        entry = mapping[prop]
-        if callable(entry[2]):
-            payload = entry[2](value)
-            if isinstance(payload, tuple):
-                # mapper returned (domain, service, data)
-                calls.append({"domain": payload[0], "service": payload[1], "data": {**payload[2], "entity_id": req.entity_id}})
-            else:
-                calls.append({"domain": entry[0], "service": entry[1], "data": {**payload, "entity_id": req.entity_id}})
-        else:
-            calls.append({"domain": entry[0], "service": entry[1], "data": {"entity_id": req.entity_id, **entry[2]}})
-
-    results = []
-    for c in calls:
-        res = await call_service(c["domain"], c["service"], c["data"])
-        results.append({"call": c, "result": res})
-    return {"status": "ok", "results": results}
\ No newline at end of file
+    try:
+        body = await run_command(req.entity_id, req.properties, req.actor)
+    except CommandError as e:
+        raise HTTPException(400, str(e))
+    if body["status"] != "ok":
+        return JSONResponse(body, status_code=502)
+    return body
+
+@router.post("/commands")
+async def set_properties_batch(req: BatchRequest):
+    """Run many property sets at once; streams one NDJSON line per entry as it completes."""
+    entries = [e.model_dump() for e in req.commands]
+
+    async def lines():
+        async for res in run_batch(entries, req.actor):
+            yield orjson.dumps(res) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@router.get("/audit")
+async def list_audit(
+    actor: Optional[str] = None,
+    target_id: Optional[str] = None,
+    action: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+):
+    """Audit records, newest first; pass the returned next_cursor to page further back."""
+    try:
+        after = decode_audit_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(400, "Invalid cursor")
+    await audit.flush()
+    rows = await db_worker.run(query_records, actor, target_id, action, since, until, after, limit)
+    return {"items": rows, "next_cursor": encode_audit_cursor(rows[-1]) if len(rows) == limit else None}
@@ -0,0 +1,113 @@
+# Asynchronous, batched audit log: recording never waits on the database.
+import asyncio, base64, logging, time, uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import and_, delete, insert, or_, select
+from .db import SessionLocal, db_worker
+from .models import Audit
+from .settings import settings
+
+log = logging.getLogger("audit")
+
+def _utc_naive(dt: datetime) -> datetime:
+    """Audit.ts is stored as naive UTC; convert aware datetimes before comparing."""
+    return dt.astimezone(timezone.utc).replace(tzinfo=None) if dt.tzinfo is not None else dt
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def insert_records(rows: List[Dict[str, Any]]):
+    with SessionLocal() as s:
+        s.execute(insert(Audit), rows)
+        s.commit()
+
+def prune_before(cutoff: datetime) -> int:
+    with SessionLocal() as s:
+        n = s.execute(delete(Audit).where(Audit.ts < cutoff)).rowcount
+        s.commit()
+        return n
+
+def query_records(actor: Optional[str], target_id: Optional[str], action: Optional[str], since: Optional[datetime],
+                  until: Optional[datetime], after: Optional[Tuple[datetime, str]], limit: int) -> List[Dict[str, Any]]:
+    """Newest first, keyset-paginated on (ts, id)."""
+    q = select(Audit)
+    if actor:
+        q = q.where(Audit.actor == actor)
+    if target_id:
+        q = q.where(Audit.target_id == target_id)
+    if action:
+        q = q.where(Audit.action == action)
+    if since:
+        q = q.where(Audit.ts >= _utc_naive(since))
+    if until:
+        q = q.where(Audit.ts < _utc_naive(until))
+    if after:
+        ts, rid = _utc_naive(after[0]), after[1]
+        q = q.where(or_(Audit.ts < ts, and_(Audit.ts == ts, Audit.id < rid)))
+    q = q.order_by(Audit.ts.desc(), Audit.id.desc()).limit(limit)
+    with SessionLocal() as s:
+        return [{
+            "id": a.id, "ts": a.ts.isoformat(), "actor": a.actor, "action": a.action,
+            "target_type": a.target_type, "target_id": a.target_id, "payload": a.payload,
+        } for a in s.scalars(q)]
+
+def encode_cursor(rec: Dict[str, Any]) -> str:
+    return base64.urlsafe_b64encode(f"{rec['ts']}|{rec['id']}".encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    ts, rid = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode().split("|", 1)
+    return datetime.fromisoformat(ts), rid
+
+class AuditWriter:
+    """Queues audit rows and bulk-inserts them on the DB worker every AUDIT_FLUSH_INTERVAL
+    seconds or once AUDIT_BATCH_SIZE rows are queued; prunes rows older than
+    AUDIT_RETENTION_DAYS once a day.
+    """
+    def __init__(self):
+        self._queue: List[Dict[str, Any]] = []
+        self._wake = asyncio.Event()
+        self.written = 0
+        self.errors = 0
+
+    def record(self, actor: Optional[str], action: str, target_type: str, target_id: str, payload: Dict[str, Any]):
+        self._queue.append({
+            "id": uuid.uuid4().hex, "ts": _utcnow(), "actor": actor, "action": action,
+            "target_type": target_type, "target_id": target_id, "payload": payload,
+        })
+        if len(self._queue) >= settings.AUDIT_BATCH_SIZE:
+            self._wake.set()
+
+    async def flush(self):
+        if not self._queue:
+            return
+        batch, self._queue = self._queue, []
+        try:
+            await db_worker.run(insert_records, batch)
+            self.written += len(batch)
+        except Exception as e:
+            # keep them for the next attempt; an audit trail must not silently lose rows
+            self.errors += 1
+            self._queue[:0] = batch
+            log.warning("audit flush of %d rows failed: %s", len(batch), e)
+
+    async def run(self):
+        last_prune = 0.0
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), settings.AUDIT_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+            if settings.AUDIT_RETENTION_DAYS and time.time() - last_prune > 86400:
+                last_prune = time.time()
+                try:
+                    n = await db_worker.run(prune_before, _utcnow() - timedelta(days=settings.AUDIT_RETENTION_DAYS))
+                    log.info("audit retention removed %d rows", n)
+                except Exception as e:
+                    log.warning("audit prune failed: %s", e)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"queue_depth": len(self._queue), "written": self.written, "errors": self.errors}
+
+audit = AuditWriter()
@@ -0,0 +1,121 @@
+# Capability index: which properties an entity can set and with which values, compiled from
+# the cached HA service schemas plus the entity's supported_features / supported_color_modes.
+from typing import Any, Dict, List, Optional, Tuple
+from .adapters import ADAPTERS, DomainAdapter
+
+def _freeze(v: Any) -> Any:
+    return tuple(v) if isinstance(v, list) else v
+
+def _field_names(fields: Dict[str, Any]) -> frozenset:
+    """Field names of a service schema; collapsible sections (a field with its own "fields",
+    e.g. light.turn_on's advanced_fields) are flattened into their member fields.
+    """
+    names = set()
+    for name, spec in (fields or {}).items():
+        nested = spec.get("fields") if isinstance(spec, dict) else None
+        if isinstance(nested, dict):
+            names |= _field_names(nested)
+        else:
+            names.add(name)
+    return frozenset(names)
+
+def check_value(prop: str, spec: Dict[str, Any], value: Any) -> Optional[str]:
+    """Why value is not acceptable for spec, or None when it is."""
+    kind = spec["type"]
+    if kind == "bool":
+        return None if isinstance(value, (bool, int)) else f"{prop} expects a boolean"
+    if kind in ("int", "float"):
+        if isinstance(value, bool):
+            return f"{prop} expects a number"
+        try:
+            v = float(value)
+        except (TypeError, ValueError):
+            return f"{prop} expects a number"
+        lo, hi = spec.get("min"), spec.get("max")
+        if (lo is not None and v < lo) or (hi is not None and v > hi):
+            return f"{prop} must be between {lo} and {hi}"
+        return None
+    if kind == "enum":
+        opts = spec.get("options")
+        return None if not opts or value in opts else f"{prop} must be one of {', '.join(map(str, opts))}"
+    if kind == "hs":
+        ok = (isinstance(value, (list, tuple)) and len(value) == 2
+              and all(isinstance(x, (int, float)) and not isinstance(x, bool) for x in value)
+              and 0 <= value[0] <= 360 and 0 <= value[1] <= 100)
+        return None if ok else f"{prop} expects [hue 0-360, saturation 0-100]"
+    return None
+
+class CapabilityIndex:
+    """Compiled capabilities per entity. An entry is reused until the entity's feature
+    attributes or the service schemas change; ordinary state updates don't recompile.
+    """
+    def __init__(self):
+        # domain -> service -> field names; empty until the first services sync
+        self.services: Dict[str, Dict[str, frozenset]] = {}
+        self.services_version = 0
+        self._cache: Dict[str, Tuple[int, tuple, Dict[str, Dict[str, Any]]]] = {}
+        self.compiles = 0
+
+    def set_services(self, services: List[Dict[str, Any]]):
+        index = {
+            s["domain"]: {name: _field_names((svc or {}).get("fields")) for name, svc in (s.get("services") or {}).items()}
+            for s in services
+        }
+        if index != self.services:
+            self.services = index
+            self.services_version += 1
+
+    def _service_allows(self, adapter: DomainAdapter, prop: str) -> bool:
+        if not self.services:
+            return True  # schemas not loaded yet: trust the adapter alone
+        domain, service = adapter.services[prop][:2]
+        fields = self.services.get(domain, {}).get(service)
+        if fields is None:
+            return False
+        field = adapter.fields.get(prop)
+        return field is None or field in fields
+
+    def get(self, entity: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        """property -> {type, min/max/options, service} for a catalog entity view."""
+        adapter = ADAPTERS.get(entity["domain"])
+        if adapter is None:
+            return {}
+        attrs = entity["attributes"] or {}
+        key = tuple(_freeze(attrs.get(k)) for k in adapter.feature_attrs)
+        hit = self._cache.get(entity["entity_id"])
+        if hit is not None and hit[0] == self.services_version and hit[1] == key:
+            return hit[2]
+        caps = {}
+        for prop, spec in adapter.capabilities(attrs).items():
+            if self._service_allows(adapter, prop):
+                entry = adapter.services[prop]
+                caps[prop] = {**spec, "service": f"{entry[0]}.{entry[1]}"}
+        self._cache[entity["entity_id"]] = (self.services_version, key, caps)
+        self.compiles += 1
+        return caps
+
+    def forget(self, eid: str):
+        self._cache.pop(eid, None)
+
+    def view(self, entity: Dict[str, Any]) -> Dict[str, Any]:
+        """Settable properties of entity with their current values and capabilities."""
+        caps = self.get(entity)
+        adapter = ADAPTERS.get(entity["domain"])
+        return {
+            "entity_id": entity["entity_id"],
+            "domain": entity["domain"],
+            "properties": adapter.read(entity, caps) if adapter else {},
+            "capabilities": caps,
+        }
+
+    def validate(self, entity: Dict[str, Any], properties: Dict[str, Any]) -> Optional[str]:
+        """First reason the properties can't be applied to entity, or None."""
+        caps = self.get(entity)
+        for prop, value in properties.items():
+            spec = caps.get(prop)
+            if spec is None:
+                return f"Property {prop} not supported by {entity['entity_id']}"
+            err = check_value(prop, spec, value)
+            if err:
+                return err
+        return None
@@ -0,0 +1,196 @@
+# Turns property requests into the minimal set of HA service calls and runs them.
+import asyncio, time
+import orjson
+from typing import AsyncIterator, Dict, Any, List, Optional, Tuple
+from .mappings import DOMAIN_FOLDS, DOMAIN_LEADING, DOMAIN_SERVICE_MAP
+from .ha_client import call_service
+from .settings import settings
+from .state import catalog
+from .audit import audit
+from .tracing import Trace, tracer
+
+class CommandError(ValueError):
+    """Raised for requests that cannot be mapped to service calls."""
+
+def plan_calls(entity_id: str, properties: Dict[str, Any]) -> List[List[Dict[str, Any]]]:
+    """Validate against the entity's capabilities, resolve properties via DOMAIN_SERVICE_MAP
+    and merge everything aimed at the same domain+service into one call, e.g.
+    on+brightness+color_temp -> one light.turn_on, or fan on+percentage -> one fan.turn_on
+    via DOMAIN_FOLDS. Returns the steps to run in order: each toggle/mode call (DOMAIN_LEADING)
+    alone, then one step with every other call, which may run concurrently.
+    """
+    domain = entity_id.split(".",1)[0]
+    if domain not in DOMAIN_SERVICE_MAP:
+        raise CommandError(f"Domain {domain} not supported for generic set")
+    # reject what the entity can't do here instead of after a round-trip to HA
+    entity = catalog.get(entity_id)
+    if entity is not None:
+        err = catalog.capabilities.validate(entity, properties)
+        if err:
+            raise CommandError(err)
+    elif catalog.entities:
+        raise CommandError(f"Unknown entity {entity_id}")
+    mapping = DOMAIN_SERVICE_MAP[domain]
+    order = {prop: n for n, prop in enumerate(mapping)}
+    merged: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    rank: Dict[Tuple[str, str], int] = {}
+    leads: set = set()
+    for prop, value in properties.items():
+        if prop not in mapping:
+            raise CommandError(f"Property {prop} not supported for domain {domain}")
+        entry = mapping[prop]
+        if callable(entry[2]):
+            try:
+                payload = entry[2](value)
+            except (TypeError, ValueError):
+                raise CommandError(f"Invalid value for {prop}: {value!r}")
+            if isinstance(payload, tuple):
+                # mapper returned (domain, service, data)
+                key, data = (payload[0], payload[1]), payload[2]
+            else:
+                key, data = (entry[0], entry[1]), payload
+        else:
+            key, data = (entry[0], entry[1]), entry[2]
+        merged.setdefault(key, {}).update(data)
+        rank[key] = min(rank.get(key, order[prop]), order[prop])
+        if prop in DOMAIN_LEADING[domain]:
+            leads.add(key)
+    services = {svc for _, svc in merged}
+    if {"turn_on", "turn_off"} <= services:
+        raise CommandError("Properties request both turn_on and turn_off")
+    for src, dst in DOMAIN_FOLDS[domain].items():
+        if (domain, src) in merged and (domain, dst) in merged:
+            merged[(domain, dst)] = {**merged.pop((domain, src)), **merged[(domain, dst)]}
+            rank[(domain, dst)] = min(rank[(domain, dst)], rank.pop((domain, src)))
+            if (domain, src) in leads:
+                leads.add((domain, dst))
+    steps: List[List[Dict[str, Any]]] = []
+    rest: List[Dict[str, Any]] = []
+    for d, svc in sorted(merged, key=rank.__getitem__):
+        call = {"domain": d, "service": svc, "data": {**merged[(d, svc)], "entity_id": entity_id}}
+        if (d, svc) in leads:
+            steps.append([call])
+        else:
+            rest.append(call)
+    return steps + [rest] if rest else steps
+
+async def _timed_call(c: Dict[str, Any], trace: Optional[Trace] = None) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    started = time.monotonic()
+    try:
+        res = await call_service(c["domain"], c["service"], c["data"])
+        out = {"call": c, "result": res}
+    except Exception as e:
+        out = {"call": c, "error": str(e) or type(e).__name__}
+    out["ms"] = round((time.perf_counter() - t0) * 1000, 2)
+    if trace is not None:
+        trace.span("call_service", started, service=f"{c['domain']}.{c['service']}", error="error" in out)
+    return out
+
+async def execute_calls(steps: List[List[Dict[str, Any]]], trace: Optional[Trace] = None) -> List[Dict[str, Any]]:
+    """Run planned steps in order, the calls within a step concurrently."""
+    results: List[Dict[str, Any]] = []
+    for calls in steps:
+        results += await asyncio.gather(*(_timed_call(c, trace) for c in calls))
+    return results
+
+def _audit(actor: Optional[str], entity_id: str, properties: Dict[str, Any], status: str, error: Optional[str] = None):
+    payload: Dict[str, Any] = {"properties": properties, "status": status}
+    if error:
+        payload["error"] = error
+    audit.record(actor, "set_properties", "entity", entity_id, payload)
+
+async def run_command(entity_id: str, properties: Dict[str, Any], actor: Optional[str] = None) -> Dict[str, Any]:
+    """Plan and execute one property set; shared by the REST and WebSocket command paths."""
+    trace = tracer.start("command", entity_id=entity_id, actor=actor)
+    try:
+        steps = plan_calls(entity_id, properties)
+    except CommandError as e:
+        _audit(actor, entity_id, properties, "rejected", str(e))
+        raise
+    if trace is not None:
+        trace.span("plan", trace.start)
+    t0 = time.perf_counter()
+    results = await execute_calls(steps, trace)
+    body = {
+        "status": "error" if any("error" in r for r in results) else "ok",
+        "results": results,
+        "ms": round((time.perf_counter() - t0) * 1000, 2),
+    }
+    _audit(actor, entity_id, properties, body["status"], next((r["error"] for r in results if "error" in r), None))
+    if trace is not None:
+        trace.finish()
+    return body
+
+def group_calls(planned: Dict[int, List[List[Dict[str, Any]]]]) -> List[Tuple[int, Dict[str, Any], List[int]]]:
+    """Fold identical service calls at the same step of their entries' plans into one call with
+    an entity_id list. planned maps entry index -> its steps; returns (step, call, entry indices).
+    """
+    groups: Dict[Tuple[int, str, str, bytes], Tuple[Dict[str, Any], List[int]]] = {}
+    for idx, steps in planned.items():
+        for step, c in ((n, c) for n, calls in enumerate(steps) for c in calls):
+            data = {k: v for k, v in c["data"].items() if k != "entity_id"}
+            key = (step, c["domain"], c["service"], orjson.dumps(data, option=orjson.OPT_SORT_KEYS))
+            if key not in groups:
+                groups[key] = ({"domain": c["domain"], "service": c["service"], "data": {**data, "entity_id": []}}, [])
+            call, members = groups[key]
+            call["data"]["entity_id"].append(c["data"]["entity_id"])
+            members.append(idx)
+    return [(key[0], call, members) for key, (call, members) in groups.items()]
+
+async def run_batch(entries: List[Dict[str, Any]], actor: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+    """Plan every entry, group identical calls and run them with bounded concurrency. Each entry's
+    calls still run in plan order: a step starts once all its entries finished the previous one.
+    Yields one result per entry as soon as all calls covering it have finished.
+    """
+    planned: Dict[int, List[List[Dict[str, Any]]]] = {}
+    for idx, e in enumerate(entries):
+        try:
+            planned[idx] = plan_calls(e["entity_id"], e["properties"])
+        except CommandError as err:
+            _audit(actor, e["entity_id"], e["properties"], "rejected", str(err))
+            yield {"index": idx, "entity_id": e["entity_id"], "status": "error", "error": str(err)}
+            continue
+        if not planned[idx]:
+            # nothing to send (empty properties): no call will ever complete this entry
+            del planned[idx]
+            _audit(actor, e["entity_id"], e["properties"], "ok")
+            yield {"index": idx, "entity_id": e["entity_id"], "status": "ok", "results": []}
+
+    groups = group_calls(planned)
+    remaining = {idx: sum(map(len, steps)) for idx, steps in planned.items()}
+    results: Dict[int, List[Dict[str, Any]]] = {idx: [] for idx in planned}
+    sem = asyncio.Semaphore(settings.COMMAND_CONCURRENCY)
+    # calls still running per (entry, step), and an event set once a step has none left
+    step_left = {(idx, n): len(calls) for idx, steps in planned.items() for n, calls in enumerate(steps)}
+    steps_done = {key: asyncio.Event() for key in step_left}
+
+    async def run(step, call, members):
+        if step:
+            for idx in members:
+                await steps_done[(idx, step - 1)].wait()
+        async with sem:
+            res = await _timed_call(call)
+        for idx in members:
+            step_left[(idx, step)] -= 1
+            if not step_left[(idx, step)]:
+                steps_done[(idx, step)].set()
+        return res, members
+
+    for fut in asyncio.as_completed([run(s, c, m) for s, c, m in groups]):
+        res, members = await fut
+        summary = {k: v for k, v in res.items() if k != "call"}
+        summary.update(domain=res["call"]["domain"], service=res["call"]["service"], targets=len(res["call"]["data"]["entity_id"]))
+        for idx in set(members):
+            results[idx].append(summary)
+            remaining[idx] -= members.count(idx)
+            if remaining[idx] == 0:
+                status = "error" if any("error" in r for r in results[idx]) else "ok"
+                _audit(actor, entries[idx]["entity_id"], entries[idx]["properties"], status,
+                       next((r["error"] for r in results[idx] if "error" in r), None))
+                yield {
+                    "index": idx,
+                    "entity_id": entries[idx]["entity_id"],
+                    "status": status,
+                    "results": results[idx],
+                }
@@ -1,9 +1,51 @@
-from sqlalchemy import create_engine
+import asyncio, functools, time
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 from .settings import settings
+from .metrics import DB_TASK, Gauge
 
 class Base(DeclarativeBase):
     pass
 
 engine = create_engine(settings.DB_URL, future=True)
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
\ No newline at end of file
+SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
+
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_conn, _record):
+        # Applied to every pooled connection. WAL lets API reads run alongside the
+        # write-behind flushes; NORMAL is durable across app crashes in WAL mode.
+        cur = dbapi_conn.cursor()
+        cur.execute(f"PRAGMA journal_mode={settings.DB_JOURNAL_MODE}")
+        cur.execute(f"PRAGMA synchronous={settings.DB_SYNCHRONOUS}")
+        cur.execute(f"PRAGMA cache_size={int(settings.DB_CACHE_SIZE)}")
+        cur.execute(f"PRAGMA mmap_size={int(settings.DB_MMAP_SIZE)}")
+        cur.execute(f"PRAGMA busy_timeout={int(settings.DB_BUSY_TIMEOUT_MS)}")
+        cur.execute("PRAGMA temp_store=MEMORY")
+        cur.close()
+
+class DBWorker:
+    """Dedicated thread for all database work issued from async code.
+    Awaiting it keeps SQLite I/O off the event loop, and a single thread
+    serializes writers so flushes never contend for the SQLite lock.
+    """
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+        self.pending = 0
+
+    async def run(self, fn, *args, **kwargs):
+        self.pending += 1
+        t0 = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, functools.partial(fn, *args, **kwargs))
+        finally:
+            self.pending -= 1
+            DB_TASK.observe(time.perf_counter() - t0, getattr(fn, "__name__", "task"))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+db_worker = DBWorker()
+Gauge("bridge_db_pending_tasks", "Tasks queued or running on the DB worker", lambda: db_worker.pending)
@@ -0,0 +1,58 @@
+# Diagnostics: slow traces, and (when DEBUG_PROFILING is on) on-demand profiling of the event loop.
+import asyncio, cProfile, io, pstats, sys, threading, traceback
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from .settings import settings
+from .tracing import tracer
+
+router = APIRouter(prefix="/debug")
+
+_profiling = asyncio.Lock()
+
+def _require_profiling():
+    if not settings.DEBUG_PROFILING:
+        raise HTTPException(404, "Profiling endpoints are disabled (DEBUG_PROFILING)")
+
+@router.get("/traces")
+async def slow_traces(limit: int = Query(50, ge=1, le=1000), name: Optional[str] = None):
+    """Most recent sampled traces slower than TRACE_SLOW_MS, newest first."""
+    traces = [t for t in reversed(tracer.slow) if name is None or t.name == name][:limit]
+    return {**tracer.stats(), "traces": [t.to_dict() for t in traces]}
+
+@router.get("/profile", response_class=PlainTextResponse)
+async def profile(
+    seconds: float = Query(5, gt=0, le=60),
+    sort: str = Query("cumulative", pattern="^(cumulative|tottime|ncalls)$"),
+    limit: int = Query(60, ge=1, le=500),
+):
+    """cProfile everything the event loop runs for `seconds` and return the pstats report."""
+    _require_profiling()
+    if _profiling.locked():
+        raise HTTPException(409, "A profile is already running")
+    async with _profiling:
+        prof = cProfile.Profile()
+        # setprofile is per thread: this captures the event loop, where the hot paths run
+        prof.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            prof.disable()
+    out = io.StringIO()
+    pstats.Stats(prof, stream=out).sort_stats(sort).print_stats(limit)
+    return out.getvalue()
+
+@router.get("/stacks", response_class=PlainTextResponse)
+async def stacks():
+    """Current stack of every thread and every pending asyncio task."""
+    _require_profiling()
+    out = io.StringIO()
+    names = {t.ident: t.name for t in threading.enumerate()}
+    for ident, frame in sys._current_frames().items():
+        out.write(f"--- thread {names.get(ident, ident)}\n")
+        out.write("".join(traceback.format_stack(frame)))
+    for task in asyncio.all_tasks():
+        out.write(f"--- task {task.get_name()} {task.get_coro()!r}\n")
+        for frame in task.get_stack():
+            out.write("".join(traceback.format_stack(frame, limit=1)))
+    return out.getvalue()
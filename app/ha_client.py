@@ -1,62 +1,252 @@
-import asyncio, json, logging, time
-import httpx, websockets
+import asyncio, importlib.util, itertools, logging, time
+import httpx, orjson, websockets
 from websockets.exceptions import ConnectionClosed
-from typing import AsyncIterator, Dict, Any
+from typing import AsyncIterator, Dict, Any, Optional
 from .settings import settings
+from .metrics import HA_REST, HA_CALL_SERVICE, HA_ERRORS
+from .tracing import tracer
 
 log = logging.getLogger("ha")
 
 AUTH_HEADERS = {"Authorization": f"Bearer {settings.HA_TOKEN}", "Content-Type": "application/json"}
 
+# One pooled client for the whole app; opened/closed with the FastAPI lifecycle.
+_client: Optional[httpx.AsyncClient] = None
+_stats = {"http2": False, "requests": 0, "retries": 0, "errors": 0, "in_flight": 0, "peak_in_flight": 0, "pool_waits": 0,
+          "ws_requests": 0, "ws_timeouts": 0, "ws_fallbacks": 0}
+
+RETRY_STATUS = {502, 503, 504}
+
+def _make_client() -> httpx.AsyncClient:
+    http2 = settings.HA_HTTP2
+    if http2 and importlib.util.find_spec("h2") is None:
+        log.warning("HA_HTTP2 requested but the 'h2' package is missing (pip install httpx[http2]); using HTTP/1.1")
+        http2 = False
+    _stats["http2"] = http2
+    return httpx.AsyncClient(
+        base_url=settings.HA_URL,
+        headers=AUTH_HEADERS,
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=settings.HA_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.HA_MAX_KEEPALIVE,
+            keepalive_expiry=settings.HA_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(settings.HA_TIMEOUT, connect=settings.HA_CONNECT_TIMEOUT),
+    )
+
+async def start_http():
+    global _client
+    if _client is None:
+        _client = _make_client()
+
+async def stop_http():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+def _http() -> httpx.AsyncClient:
+    # lazily created for callers outside the app lifecycle (scripts, benchmarks)
+    global _client
+    if _client is None:
+        _client = _make_client()
+    return _client
+
+async def _request(method: str, path: str, **kw) -> httpx.Response:
+    _stats["requests"] += 1
+    if _stats["in_flight"] >= settings.HA_MAX_CONNECTIONS:
+        _stats["pool_waits"] += 1
+    _stats["in_flight"] += 1
+    _stats["peak_in_flight"] = max(_stats["peak_in_flight"], _stats["in_flight"])
+    try:
+        return await _http().request(method, path, **kw)
+    except httpx.HTTPError:
+        _stats["errors"] += 1
+        raise
+    finally:
+        _stats["in_flight"] -= 1
+
+def http_stats() -> Dict[str, Any]:
+    return {**_stats, "max_connections": settings.HA_MAX_CONNECTIONS}
+
 async def rest_get(path: str):
-    async with httpx.AsyncClient() as c:
-        r = await c.get(f"{settings.HA_URL}{path}", headers=AUTH_HEADERS, timeout=15)
-        r.raise_for_status()
-        return r.json()
+    t0 = time.perf_counter()
+    try:
+        return await _rest_get(path)
+    finally:
+        HA_REST.observe(time.perf_counter() - t0, "GET", path)
+
+async def _rest_get(path: str):
+    # GETs are idempotent: retry transport errors and gateway failures with backoff
+    delay = settings.HA_RETRY_BACKOFF
+    for attempt in range(settings.HA_GET_RETRIES + 1):
+        last = attempt == settings.HA_GET_RETRIES
+        try:
+            r = await _request("GET", path)
+        except httpx.TransportError:
+            if last:
+                raise
+        else:
+            if r.status_code not in RETRY_STATUS or last:
+                r.raise_for_status()
+                return orjson.loads(r.content)
+        _stats["retries"] += 1
+        await asyncio.sleep(delay)
+        delay *= 2
 
 async def rest_post(path: str, data: Dict[str, Any]):
-    async with httpx.AsyncClient() as c:
-        r = await c.post(f"{settings.HA_URL}{path}", headers=AUTH_HEADERS, timeout=15, content=json.dumps(data))
+    t0 = time.perf_counter()
+    try:
+        r = await _request("POST", path, content=orjson.dumps(data))
         r.raise_for_status()
-        return r.json()
+        return orjson.loads(r.content)
+    finally:
+        HA_REST.observe(time.perf_counter() - t0, "POST", path)
+
+# Request/response multiplexing over the event WebSocket: each outgoing message
+# id gets a future that the reader loop in ws_messages resolves on its "result".
+class WSUnavailable(ConnectionError):
+    """No authenticated WebSocket to send on; the message was never sent."""
+
+class WSConnectionLost(ConnectionError):
+    """The socket dropped after the message was sent; HA may or may not have applied it."""
+
+class WSCommandError(RuntimeError):
+    """HA answered a WS command with success=false."""
+
+_ws = None
+_ws_ids = itertools.count(1)
+_pending: Dict[int, asyncio.Future] = {}
+
+def _text(obj: Dict[str, Any]) -> str:
+    # HA only accepts text frames; websockets sends bytes as binary
+    return orjson.dumps(obj).decode()
+
+async def _ws_send(obj: Dict[str, Any]) -> int:
+    obj["id"] = next(_ws_ids)
+    await _ws.send(_text(obj))
+    return obj["id"]
+
+async def ws_request(obj: Dict[str, Any], timeout: Optional[float] = None) -> Any:
+    """Send a command on the shared socket and wait for its result message."""
+    if _ws is None:
+        raise WSUnavailable("HA WebSocket not connected")
+    fut = asyncio.get_running_loop().create_future()
+    obj = dict(obj)
+    obj["id"] = next(_ws_ids)
+    _pending[obj["id"]] = fut
+    _stats["ws_requests"] += 1
+    timeout = timeout or settings.HA_WS_TIMEOUT
+    try:
+        try:
+            await _ws.send(_text(obj))
+        except ConnectionClosed as e:
+            raise WSUnavailable(str(e))
+        msg = await asyncio.wait_for(fut, timeout)
+    except asyncio.TimeoutError:
+        _stats["ws_timeouts"] += 1
+        what = f"{obj['domain']}.{obj['service']}" if obj["type"] == "call_service" else obj["type"]
+        raise asyncio.TimeoutError(f"no result for {what} within {timeout}s") from None
+    finally:
+        _pending.pop(obj["id"], None)
+    if not msg.get("success", False):
+        raise WSCommandError((msg.get("error") or {}).get("message", "unknown error"))
+    return msg.get("result")
+
+def _fail_pending(exc: Exception):
+    for fut in _pending.values():
+        if not fut.done():
+            fut.set_exception(exc)
+    _pending.clear()
 
 async def ws_messages() -> AsyncIterator[Dict[str, Any]]:
+    global _ws, _ws_ids
     url = settings.HA_URL.replace("http", "ws") + "/api/websocket"
     while True:
         try:
-            async with websockets.connect(url) as ws:
+            async with websockets.connect(url, max_size=settings.HA_WS_MAX_SIZE or None) as ws:
                 # handshake
-                msg = json.loads(await ws.recv())
+                msg = orjson.loads(await ws.recv())
                 assert msg["type"] == "auth_required"
-                await ws.send(json.dumps({"type":"auth", "access_token": settings.HA_TOKEN}))
-                ok = json.loads(await ws.recv())
+                await ws.send(_text({"type":"auth", "access_token": settings.HA_TOKEN}))
+                ok = orjson.loads(await ws.recv())
                 assert ok["type"] == "auth_ok"
+                _ws, _ws_ids = ws, itertools.count(1)
 
                 # subscribe to events
-                msg_id = 1
-                async def send(obj):
-                    nonlocal msg_id
-                    obj["id"] = msg_id; msg_id += 1
-                    await ws.send(json.dumps(obj))
-
-                await send({"type":"subscribe_events","event_type":"state_changed"})
-                await send({"type":"area_registry/list"})
-                await send({"type":"device_registry/list"})
-                await send({"type":"entity_registry/list"})
+                await _ws_send({"type":"subscribe_events","event_type":"state_changed"})
+                for ev in ("area_registry_updated", "device_registry_updated", "entity_registry_updated"):
+                    await _ws_send({"type":"subscribe_events","event_type":ev})
+                # registry snapshots; their results are tagged with "command" for the consumer
+                snapshots = {}
+                for kind in ("area_registry/list", "device_registry/list", "entity_registry/list"):
+                    snapshots[await _ws_send({"type":kind})] = kind
 
                 while True:
                     raw = await ws.recv()
-                    yield json.loads(raw)
+                    received = time.monotonic()
+                    msg = orjson.loads(raw)
+                    if msg.get("type") == "event":
+                        trace = tracer.start("ha_event", received)
+                        if trace is not None:
+                            # picked up by the consumer, like the "command" tag below
+                            trace.span("parse", received)
+                            msg["_trace"] = trace
+                    elif msg.get("type") == "result":
+                        fut = _pending.get(msg.get("id"))
+                        if fut is not None:
+                            if not fut.done():
+                                fut.set_result(msg)
+                            continue
+                        if msg.get("id") in snapshots:
+                            msg["command"] = snapshots.pop(msg["id"])
+                    yield msg
         except (ConnectionClosed, OSError) as e:
             log.warning("WS disconnected: %s; retrying in 2s", e)
             await asyncio.sleep(2)
+        finally:
+            _ws = None
+            # these were sent: like a timeout, the outcome is unknown and must not be retried blindly
+            _fail_pending(WSConnectionLost("HA WebSocket disconnected before the result arrived"))
 
-# convenience helpers
+# convenience helpers: prefer the warm WebSocket, fall back to REST
 async def list_states():
+    # deliberately REST: a multi-MB get_states frame would hold up events on the shared socket
     return await rest_get("/api/states")
 
 async def list_services():
+    if settings.HA_WS_COMMANDS:
+        try:
+            res = await ws_request({"type": "get_services"})
+            # same shape as REST /api/services
+            return [{"domain": d, "services": svcs} for d, svcs in res.items()]
+        except (WSUnavailable, WSConnectionLost, WSCommandError, asyncio.TimeoutError):
+            _stats["ws_fallbacks"] += 1
     return await rest_get("/api/services")
 
 async def call_service(domain: str, service: str, data: Dict[str, Any]):
-    return await rest_post(f"/api/services/{domain}/{service}", data)
\ No newline at end of file
+    t0 = time.perf_counter()
+    transport = "rest"
+    try:
+        if settings.HA_WS_COMMANDS:
+            data = dict(data)
+            target = {"entity_id": data.pop("entity_id")} if "entity_id" in data else None
+            msg = {"type": "call_service", "domain": domain, "service": service, "service_data": data}
+            if target:
+                msg["target"] = target
+            try:
+                transport = "ws"
+                return await ws_request(msg)
+            except WSUnavailable:
+                # never sent, so REST can't double-apply it; a timeout is not retried for that reason
+                _stats["ws_fallbacks"] += 1
+                transport = "rest"
+                if target:
+                    data.update(target)
+        return await rest_post(f"/api/services/{domain}/{service}", data)
+    except Exception:
+        HA_ERRORS.inc(domain, service)
+        raise
+    finally:
+        HA_CALL_SERVICE.observe(time.perf_counter() - t0, domain, service, transport)
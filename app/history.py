@@ -0,0 +1,186 @@
+# Append-only numeric state history with 1m/1h/1d rollups, fed from ws_consumer.
+import asyncio, logging, math, time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.sqlite import insert
+from .db import SessionLocal, db_worker
+from .models import StateHistory, StateRollup
+from .settings import settings
+
+log = logging.getLogger("history")
+
+RESOLUTIONS = {"1m": 60, "1h": 3600, "1d": 86400}
+# longest span each resolution serves when none is requested (~1000 points max)
+AUTO_SPANS = (("raw", 6 * 3600), ("1m", 2 * 86400), ("1h", 60 * 86400))
+
+def _retention() -> Dict[str, int]:
+    return {
+        "raw": settings.HISTORY_RAW_RETENTION_DAYS,
+        "1m": settings.HISTORY_1M_RETENTION_DAYS,
+        "1h": settings.HISTORY_1H_RETENTION_DAYS,
+        "1d": settings.HISTORY_1D_RETENTION_DAYS,
+    }
+
+def _parse_ts(value: Optional[str]) -> float:
+    if value:
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            pass
+    return time.time()
+
+def _accumulate(acc: Dict[Tuple[str, int, int], List[float]], eid: str, ts: float, value: float):
+    for res in RESOLUTIONS.values():
+        key = (eid, res, int(ts - ts % res))
+        a = acc.get(key)
+        if a is None:
+            acc[key] = [value, value, value, 1]
+        else:
+            a[0] = min(a[0], value); a[1] = max(a[1], value); a[2] += value; a[3] += 1
+
+def write_batch(raw: List[Tuple[str, float, float]]) -> int:
+    """Append raw points and add the ones actually inserted to the rollups, so points
+    re-delivered after a reconnect (already stored) are not counted twice.
+    """
+    acc: Dict[Tuple[str, int, int], List[float]] = {}
+    with SessionLocal() as s:
+        inserted = s.execute(
+            insert(StateHistory).on_conflict_do_nothing()
+            .returning(StateHistory.entity_id, StateHistory.ts, StateHistory.value),
+            [{"entity_id": eid, "ts": ts, "day": int(ts // 86400), "value": v} for eid, ts, v in raw],
+        ).all()
+        for eid, ts, v in inserted:
+            _accumulate(acc, eid, ts, v)
+        if acc:
+            stmt = insert(StateRollup)
+            # merge into existing buckets so partial flushes add up
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[StateRollup.entity_id, StateRollup.resolution, StateRollup.bucket],
+                set_={
+                    "min": func.min(StateRollup.min, stmt.excluded.min),
+                    "max": func.max(StateRollup.max, stmt.excluded.max),
+                    "sum": StateRollup.sum + stmt.excluded.sum,
+                    "count": StateRollup.count + stmt.excluded.count,
+                },
+            )
+            s.execute(stmt, [
+                {"entity_id": eid, "resolution": res, "bucket": b, "min": a[0], "max": a[1], "sum": a[2], "count": int(a[3])}
+                for (eid, res, b), a in acc.items()
+            ])
+        s.commit()
+    return len(inserted)
+
+def prune(now: float) -> Dict[str, int]:
+    removed = {}
+    with SessionLocal() as s:
+        for name, days in _retention().items():
+            if not days:
+                continue
+            cutoff = now - days * 86400
+            if name == "raw":
+                q = delete(StateHistory).where(StateHistory.day < int(cutoff // 86400))
+            else:
+                q = delete(StateRollup).where(StateRollup.resolution == RESOLUTIONS[name], StateRollup.bucket < cutoff)
+            removed[name] = s.execute(q).rowcount
+        s.commit()
+    return removed
+
+def read_raw(eid: str, start: float, end: float) -> List[List[float]]:
+    with SessionLocal() as s:
+        rows = s.execute(select(StateHistory.ts, StateHistory.value)
+                         .where(StateHistory.entity_id == eid, StateHistory.ts >= start, StateHistory.ts < end)
+                         .order_by(StateHistory.ts))
+        return [[ts, v] for ts, v in rows]
+
+def read_rollup(eid: str, res: int, start: float, end: float) -> Dict[int, List[float]]:
+    with SessionLocal() as s:
+        rows = s.execute(select(StateRollup.bucket, StateRollup.min, StateRollup.max, StateRollup.sum, StateRollup.count)
+                         .where(StateRollup.entity_id == eid, StateRollup.resolution == res,
+                                StateRollup.bucket >= start - start % res, StateRollup.bucket < end))
+        return {b: [mn, mx, sm, n] for b, mn, mx, sm, n in rows}
+
+class HistoryStore:
+    """Buffers numeric states and their 1m/1h/1d aggregates in memory and appends them in
+    one transaction per HISTORY_FLUSH_INTERVAL on the DB worker. Queries merge whatever is
+    still buffered, so results are current without forcing a flush. A failed flush is
+    retried with the next one.
+    """
+    def __init__(self):
+        self._raw: List[Tuple[str, float, float]] = []
+        # aggregates of the buffered points, only for merging into queries
+        self._acc: Dict[Tuple[str, int, int], List[float]] = {}
+        self._buffered: Set[Tuple[str, float]] = set()
+        self.points = 0
+        self.last_flush_ms = 0.0
+
+    def record(self, eid: str, state: Optional[str], last_updated: Optional[str] = None):
+        try:
+            value = float(state)
+        except (TypeError, ValueError):
+            return  # on/off, unavailable, ... are not charted
+        if not math.isfinite(value):
+            return
+        ts = _parse_ts(last_updated)
+        if (eid, ts) in self._buffered:
+            return  # re-delivered before the flush
+        self._buffered.add((eid, ts))
+        self._raw.append((eid, ts, value))
+        _accumulate(self._acc, eid, ts, value)
+        self.points += 1
+
+    async def flush(self):
+        if not self._raw:
+            return
+        raw, acc, buffered = self._raw, self._acc, self._buffered
+        self._raw, self._acc, self._buffered = [], {}, set()
+        t0 = time.perf_counter()
+        try:
+            await db_worker.run(write_batch, raw)
+        except Exception as e:
+            # put the points back in front of anything recorded meanwhile; retried next flush
+            log.warning("history flush of %d points failed: %s", len(raw), e)
+            fresh, self._raw, self._acc = self._raw, raw, acc
+            self._buffered = buffered
+            for eid, ts, v in fresh:
+                if (eid, ts) not in self._buffered:
+                    self._buffered.add((eid, ts))
+                    self._raw.append((eid, ts, v))
+                    _accumulate(self._acc, eid, ts, v)
+            return
+        self.last_flush_ms = (time.perf_counter() - t0) * 1000
+
+    async def run(self):
+        last_prune = 0.0
+        while True:
+            await asyncio.sleep(settings.HISTORY_FLUSH_INTERVAL)
+            await self.flush()
+            if time.time() - last_prune > 3600:
+                last_prune = time.time()
+                try:
+                    removed = await db_worker.run(prune, last_prune)
+                    log.info("history retention: %s", removed)
+                except Exception as e:
+                    log.warning("history prune failed: %s", e)
+
+    async def query(self, eid: str, start: float, end: float, resolution: Optional[str] = None) -> Dict[str, Any]:
+        if resolution is None:
+            span = end - start
+            resolution = next((name for name, limit in AUTO_SPANS if span <= limit), "1d")
+        if resolution == "raw":
+            points = await db_worker.run(read_raw, eid, start, end)
+            points += [[ts, v] for e, ts, v in self._raw if e == eid and start <= ts < end]
+            points.sort()
+            return {"entity_id": eid, "resolution": "raw", "columns": ["ts", "value"], "points": points}
+        res = RESOLUTIONS.get(resolution)
+        if res is None:
+            raise ValueError(f"resolution must be one of raw, {', '.join(RESOLUTIONS)}")
+        buckets = await db_worker.run(read_rollup, eid, res, start, end)
+        for (e, r, b), a in self._acc.items():
+            if e == eid and r == res and start - start % res <= b < end:
+                cur = buckets.get(b)
+                buckets[b] = list(a) if cur is None else [min(cur[0], a[0]), max(cur[1], a[1]), cur[2] + a[2], cur[3] + a[3]]
+        points = [[b, mn, mx, sm / n] for b, (mn, mx, sm, n) in sorted(buckets.items())]
+        return {"entity_id": eid, "resolution": resolution, "columns": ["ts", "min", "max", "avg"], "points": points}
+
+history = HistoryStore()
@@ -1,29 +1,48 @@
-import asyncio, logging
-from fastapi import FastAPI
+import asyncio, logging, time
+from typing import List, Optional
+from fastapi import FastAPI, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from .settings import settings
 from .state import catalog
 from .api import router as api_router
-from .realtime import broadcaster
+from .ws_api import router as ws_router
+from .realtime import broadcaster, OVERFLOW_POLICIES
 from .sse import sse_stream
+from .persist import writer
+from .history import history
+from .audit import audit
+from .db import db_worker
+from .ha_client import start_http, stop_http
+from .metrics import MetricsMiddleware, render as render_metrics, run_probe
+from .debug import router as debug_router
 
 logging.basicConfig(level=getattr(logging, settings.LOG_LEVEL, "INFO"))
 
 app = FastAPI(title="HA Device Bridge", version="0.1.0")
 app.include_router(api_router)
+app.include_router(ws_router)
+app.include_router(debug_router)
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+app.add_middleware(MetricsMiddleware)
 
 @app.on_event("startup")
 async def on_start():
+    await start_http()
     await catalog.init_db()
 
+    broadcaster.snapshot = catalog.snapshot
+
+    async def _broadcast(ev, area_id=None, delta=None, trace=None):
+        await broadcaster.broadcast(ev, area_id, delta, trace)
+
     async def do_full_sync_with_retry():
         import asyncio, logging
         log = logging.getLogger("startup")
         delay = 2
         while True:
             try:
-                await catalog.full_sync()
+                await catalog.full_sync(_broadcast)
                 log.info("Initial full_sync succeeded")
                 return
             except Exception as e:
@@ -33,23 +52,70 @@ async def on_start():
 
     # Kick off full sync in the background so startup doesn't crash on DNS/connectivity issues
     asyncio.create_task(do_full_sync_with_retry())
-
-    async def _broadcast(ev):
-        await broadcaster.broadcast(ev)
     asyncio.create_task(catalog.ws_consumer(_broadcast))
+    asyncio.create_task(writer.run())
+    if settings.HISTORY_ENABLED:
+        asyncio.create_task(history.run())
+    asyncio.create_task(audit.run())
+    asyncio.create_task(run_probe())
+
+@app.on_event("shutdown")
+async def on_stop():
+    await writer.flush()
+    await history.flush()
+    await audit.flush()
+    await stop_http()
+    db_worker.shutdown()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus text exposition of the bridge's internal metrics."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+def _split(values: Optional[List[str]]) -> List[str]:
+    # accept both ?domain=a&domain=b and ?domain=a,b
+    return [v for raw in values or () for v in raw.split(",") if v]
 
 @app.get("/api/v1/status/stream")
-async def stream():
+async def stream(
+    overflow: Optional[str] = None,
+    entity_id: Optional[List[str]] = Query(None),
+    domain: Optional[List[str]] = Query(None),
+    area: Optional[List[str]] = Query(None),
+    pattern: Optional[List[str]] = Query(None),
+    delta: bool = False,
+    last_event_id: Optional[str] = Query(None),
+    last_event_id_header: Optional[str] = Header(None, alias="Last-Event-ID"),
+):
     # wrap broadcaster.register() so it becomes an async generator,
     # and return EventSourceResponse directly (not a coroutine).
     from .sse import EventSourceResponse
 
+    if overflow and overflow not in OVERFLOW_POLICIES:
+        raise HTTPException(400, f"overflow must be one of {', '.join(OVERFLOW_POLICIES)}")
+
     async def event_generator():
-        async for ev in broadcaster.register():
-            yield ev
+        async for ev in broadcaster.register(
+            overflow, last_event_id_header or last_event_id,
+            entity_ids=_split(entity_id), domains=_split(domain), areas=_split(area), patterns=_split(pattern),
+            delta=delta,
+        ):
+            if ev.trace is None:
+                # pre-encoded once per event, shared by every subscriber
+                yield ev.sse
+                continue
+            # the generator resumes once sse-starlette has written the chunk
+            t0 = time.monotonic()
+            yield ev.sse
+            ev.trace.span("sse_write", t0)
+            ev.trace.finish()
 
     return EventSourceResponse(event_generator(), ping=15)
 
+@app.get("/api/v1/status/subscribers")
+async def subscribers():
+    return broadcaster.stats()
+
 @app.get("/")
-def root():
+async def root():
     return {"name":"ha-device-bridge","status":"ok"}
\ No newline at end of file
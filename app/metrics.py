@@ -0,0 +1,142 @@
+# In-process metrics rendered in the Prometheus text format at /metrics.
+# Updates are plain dict/list increments on the event loop, so they stay on in production.
+import asyncio, bisect, time
+from typing import Callable, Dict, Iterable, List, Tuple
+from .settings import settings
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _num(v: float) -> str:
+    return "+Inf" if v == float("inf") else repr(float(v)) if isinstance(v, float) else str(v)
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name, self.help, self.labelnames = name, help, labels
+        self.values: Dict[Tuple[str, ...], float] = {}
+        REGISTRY.append(self)
+
+    def inc(self, *labels: str, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def total(self) -> float:
+        return sum(self.values.values())
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, v in sorted(self.values.items()):
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_num(v)}"
+
+class Gauge:
+    """Read at scrape time from fn, which returns a number or a list of (label values, number)."""
+    def __init__(self, name: str, help: str, fn: Callable, labels: Tuple[str, ...] = ()):
+        self.name, self.help, self.fn, self.labelnames = name, help, fn, labels
+        REGISTRY.append(self)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        value = self.fn()
+        for labels, v in (value if isinstance(value, list) else [((), value)]):
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_num(v)}"
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, labels
+        self.buckets = buckets
+        # label values -> [per-bucket counts (+Inf last), sum]
+        self.series: Dict[Tuple[str, ...], list] = {}
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *labels: str):
+        s = self.series.get(labels)
+        if s is None:
+            s = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        s[0][bisect.bisect_left(self.buckets, value)] += 1
+        s[1] += value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total) in sorted(self.series.items()):
+            acc = 0
+            for le, n in zip(self.buckets + (float("inf"),), counts):
+                acc += n
+                bucket = 'le="%s"' % _num(le)
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, bucket)} {acc}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_num(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {acc}"
+
+REGISTRY: List = []
+
+def render() -> str:
+    return "\n".join(line for m in REGISTRY for line in m.render()) + "\n"
+
+# event loop
+LOOP_LAG = Histogram("bridge_event_loop_lag_seconds", "Delay of the periodic lag probe beyond its scheduled wake-up")
+_last = {"lag": 0.0, "events_per_second": 0.0}
+Gauge("bridge_event_loop_lag_last_seconds", "Most recent event loop lag sample", lambda: _last["lag"])
+
+# HA WebSocket consumer
+WS_MESSAGES = Counter("bridge_ws_messages_total", "Messages handled by ws_consumer", ("kind",))
+WS_PROCESSING = Histogram("bridge_ws_processing_seconds", "ws_consumer time per message", ("kind",))
+Gauge("bridge_ws_messages_per_second", "ws_consumer throughput over the last probe interval", lambda: _last["events_per_second"])
+
+# fan-out
+BROADCAST_FANOUT = Histogram("bridge_broadcast_fanout_subscribers", "Subscribers each published event was queued for",
+                             buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250, 1000))
+
+# HA calls
+HA_REST = Histogram("bridge_ha_rest_seconds", "HA REST latency including retries", ("method", "path"))
+HA_CALL_SERVICE = Histogram("bridge_ha_call_service_seconds", "call_service latency", ("domain", "service", "transport"))
+HA_ERRORS = Counter("bridge_ha_call_service_errors_total", "Failed call_service calls", ("domain", "service"))
+
+# database
+DB_TASK = Histogram("bridge_db_task_seconds", "DB worker task latency including queue wait", ("task",))
+
+# HTTP
+HTTP_REQUEST = Histogram("bridge_http_request_seconds", "Time to response start per route", ("method", "route", "status"))
+
+async def run_probe():
+    """Samples event loop lag (how late a timed sleep wakes up) and ws_consumer throughput."""
+    interval = settings.METRICS_PROBE_INTERVAL
+    last_count, last_t = WS_MESSAGES.total(), time.perf_counter()
+    while True:
+        await asyncio.sleep(interval)
+        now = time.perf_counter()
+        lag = max(0.0, now - last_t - interval)
+        LOOP_LAG.observe(lag)
+        count = WS_MESSAGES.total()
+        _last["lag"] = lag
+        _last["events_per_second"] = round((count - last_count) / (now - last_t), 2)
+        last_count, last_t = count, now
+
+class MetricsMiddleware:
+    """Pure ASGI middleware timing HTTP requests up to the response start, labelled by
+    route template (so /entities/{entity_id} is one series); streams count only their setup.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        t0 = time.perf_counter()
+        done = False
+
+        async def timed_send(message):
+            nonlocal done
+            if message["type"] == "http.response.start" and not done:
+                done = True
+                route = scope.get("route")
+                HTTP_REQUEST.observe(time.perf_counter() - t0, scope["method"],
+                                     getattr(route, "path", "unmatched"), str(message["status"]))
+            await send(message)
+
+        await self.app(scope, receive, timed_send)
@@ -0,0 +1,35 @@
+# Minimal schema migrations tracked in SQLite's PRAGMA user_version.
+# create_all only creates missing tables, so anything added to an existing
+# table (indexes, columns) needs a step here. Steps must be idempotent.
+import logging
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+log = logging.getLogger("migrations")
+
+MIGRATIONS = [
+    (1, [
+        "CREATE INDEX IF NOT EXISTS ix_entities_domain ON entities (domain)",
+        "CREATE INDEX IF NOT EXISTS ix_entities_area_id ON entities (area_id)",
+        "CREATE INDEX IF NOT EXISTS ix_entities_device_id ON entities (device_id)",
+        "CREATE INDEX IF NOT EXISTS ix_devices_area_id ON devices (area_id)",
+        "CREATE INDEX IF NOT EXISTS ix_audit_log_ts ON audit_log (ts)",
+    ]),
+    (2, [
+        "CREATE INDEX IF NOT EXISTS ix_audit_log_actor_ts ON audit_log (actor, ts)",
+        "CREATE INDEX IF NOT EXISTS ix_audit_log_target_id_ts ON audit_log (target_id, ts)",
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def migrate(engine: Engine):
+    with engine.begin() as conn:
+        current = conn.execute(text("PRAGMA user_version")).scalar() or 0
+        for version, statements in MIGRATIONS:
+            if version <= current:
+                continue
+            for stmt in statements:
+                conn.execute(text(stmt))
+            conn.execute(text(f"PRAGMA user_version={version}"))
+            log.info("Applied schema migration %d", version)
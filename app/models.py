@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, JSON, TIMESTAMP, ForeignKey, Text
+from sqlalchemy import Column, String, JSON, TIMESTAMP, ForeignKey, Text, Float, Integer, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .db import Base
@@ -15,7 +15,7 @@ class Device(Base):
     name = Column(String)
     manufacturer = Column(String)
     model = Column(String)
-    area_id = Column(String, ForeignKey("areas.id"))
+    area_id = Column(String, ForeignKey("areas.id"), index=True)
     hw_version = Column(String)
     sw_version = Column(String)
     identifiers = Column(JSON)
@@ -26,9 +26,9 @@ class Device(Base):
 class Entity(Base):
     __tablename__ = "entities"
     id = Column(String, primary_key=True)  # entity_id
-    device_id = Column(String, ForeignKey("devices.id"))
-    area_id = Column(String, ForeignKey("areas.id"))
-    domain = Column(String, nullable=False)
+    device_id = Column(String, ForeignKey("devices.id"), index=True)
+    area_id = Column(String, ForeignKey("areas.id"), index=True)
+    domain = Column(String, nullable=False, index=True)
     platform = Column(String)
     category = Column(String)
     name = Column(String)
@@ -48,10 +48,40 @@ class Alias(Base):
 
 class Audit(Base):
     __tablename__ = "audit_log"
+    __table_args__ = (
+        Index("ix_audit_log_actor_ts", "actor", "ts"),
+        Index("ix_audit_log_target_id_ts", "target_id", "ts"),
+    )
     id = Column(String, primary_key=True)
-    ts = Column(TIMESTAMP, server_default=func.now())
+    ts = Column(TIMESTAMP, server_default=func.now(), index=True)
     actor = Column(String)
     action = Column(String)
     target_type = Column(String)
     target_id = Column(String)
-    payload = Column(JSON)
\ No newline at end of file
+    payload = Column(JSON)
+
+class StateHistory(Base):
+    """Append-only numeric states; WITHOUT ROWID so rows are clustered by (entity_id, ts).
+    `day` (epoch day) is the retention partition key.
+    """
+    __tablename__ = "state_history"
+    __table_args__ = {"sqlite_with_rowid": False}
+    entity_id = Column(String, primary_key=True)
+    ts = Column(Float, primary_key=True)  # epoch seconds
+    day = Column(Integer, nullable=False, index=True)
+    value = Column(Float, nullable=False)
+
+class StateRollup(Base):
+    """Precomputed min/max/sum/count per entity and bucket (resolution in seconds: 60, 3600, 86400)."""
+    __tablename__ = "state_rollups"
+    __table_args__ = (
+        Index("ix_state_rollups_resolution_bucket", "resolution", "bucket"),
+        {"sqlite_with_rowid": False},
+    )
+    entity_id = Column(String, primary_key=True)
+    resolution = Column(Integer, primary_key=True)
+    bucket = Column(Integer, primary_key=True)  # bucket start, epoch seconds
+    min = Column(Float, nullable=False)
+    max = Column(Float, nullable=False)
+    sum = Column(Float, nullable=False)
+    count = Column(Integer, nullable=False)
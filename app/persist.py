@@ -0,0 +1,134 @@
+import asyncio, logging, time
+from typing import Dict, Any, List
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.sql import func
+from .db import Base, SessionLocal, engine, db_worker
+from .models import Area, Alias, Device, Entity
+from .migrations import migrate
+from .settings import settings
+from .metrics import Gauge
+
+log = logging.getLogger("persist")
+
+def init_schema():
+    Base.metadata.create_all(engine)
+    if engine.dialect.name == "sqlite":
+        migrate(engine)
+
+def load_catalog() -> Dict[str, List[Dict[str, Any]]]:
+    """Everything persisted, as plain dicts, to warm the in-memory store at startup."""
+    with SessionLocal() as s:
+        return {
+            "areas": [{"id": a.id, "name": a.name} for a in s.scalars(select(Area))],
+            "devices": [{c.name: getattr(d, c.name) for c in Device.__table__.columns} for d in s.scalars(select(Device))],
+            "entities": [{c.name: getattr(e, c.name) for c in Entity.__table__.columns} for e in s.scalars(select(Entity))],
+            "aliases": [{"entity_id": a.entity_id, "alias": a.alias} for a in s.scalars(select(Alias))],
+        }
+
+def upsert_entities(rows: List[Dict[str, Any]]):
+    """Bulk INSERT .. ON CONFLICT(id) DO UPDATE in a single transaction.
+    Only the columns present in a row are updated on conflict.
+    """
+    groups: Dict[tuple, List[Dict[str, Any]]] = {}
+    for r in rows:
+        # domain is NOT NULL, so partial rows still need it for the INSERT half
+        r.setdefault("domain", r["id"].split(".",1)[0])
+        groups.setdefault(tuple(sorted(r)), []).append(r)
+    with SessionLocal() as s:
+        for keys, batch in groups.items():
+            stmt = insert(Entity)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[Entity.id],
+                set_={**{k: stmt.excluded[k] for k in keys if k != "id"}, "updated_at": func.now()},
+            )
+            s.execute(stmt, batch)
+        s.commit()
+
+def replace_rows(model, rows: List[Dict[str, Any]]):
+    """Make a small registry table (areas, devices) match a snapshot: bulk upsert + delete the rest."""
+    with SessionLocal() as s:
+        if rows:
+            stmt = insert(model)
+            cols = [k for k in rows[0] if k != "id"]
+            s.execute(stmt.on_conflict_do_update(index_elements=[model.id], set_={k: stmt.excluded[k] for k in cols}), rows)
+        s.execute(delete(model).where(model.id.not_in([r["id"] for r in rows])))
+        s.commit()
+
+def delete_entities(ids: List[str], chunk: int = 500):
+    with SessionLocal() as s:
+        for i in range(0, len(ids), chunk):
+            s.execute(delete(Entity).where(Entity.id.in_(ids[i:i+chunk])))
+        s.commit()
+
+class WriteBehind:
+    """Coalesces entity rows per entity_id (last write wins) and flushes them
+    in one bulk upsert, off the event loop, every PERSIST_FLUSH_INTERVAL seconds
+    or as soon as PERSIST_BATCH_SIZE distinct entities are pending.
+    """
+    def __init__(self, interval: float, batch_size: int):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._wake = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self.flushes = 0
+        self.rows_written = 0
+        self.errors = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+
+    def put(self, row: Dict[str, Any]):
+        prev = self._pending.get(row["id"])
+        self._pending[row["id"]] = {**prev, **row} if prev else row
+        if len(self._pending) >= self.batch_size:
+            self._wake.set()
+
+    def discard(self, ids: List[str]):
+        for eid in ids:
+            self._pending.pop(eid, None)
+
+    async def flush(self):
+        async with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            t0 = time.perf_counter()
+            try:
+                await db_worker.run(upsert_entities, list(batch.values()))
+            except Exception as e:
+                self.errors += 1
+                log.warning("flush of %d rows failed: %s; requeueing", len(batch), e)
+                # keep newer writes that arrived while flushing
+                for eid, row in batch.items():
+                    if eid in self._pending:
+                        self._pending[eid] = {**row, **self._pending[eid]}
+                    else:
+                        self._pending[eid] = row
+                return
+            self.last_flush_ms = (time.perf_counter() - t0) * 1000
+            self.max_flush_ms = max(self.max_flush_ms, self.last_flush_ms)
+            self.flushes += 1
+            self.rows_written += len(batch)
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": len(self._pending),
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "errors": self.errors,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "max_flush_ms": round(self.max_flush_ms, 3),
+        }
+
+writer = WriteBehind(settings.PERSIST_FLUSH_INTERVAL, settings.PERSIST_BATCH_SIZE)
+Gauge("bridge_persist_queue_depth", "Entity rows waiting for the next write-behind flush", lambda: len(writer._pending))
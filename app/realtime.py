@@ -1,21 +1,341 @@
-import asyncio
-from typing import AsyncIterator, Callable
+import asyncio, fnmatch, itertools, time
+import orjson
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Callable, Dict, Any, Iterable, List, Optional, Set
+from .settings import settings
+from .metrics import BROADCAST_FANOUT, Gauge
+from .tracing import Trace
+
+try:
+    import msgpack
+except ImportError:  # optional: binary frames for WebSocket clients
+    msgpack = None
+
+OVERFLOW_POLICIES = ("drop_oldest", "coalesce", "disconnect")
+
+class Frame:
+    """One published event shared by every subscriber queue. The orjson/SSE
+    encodings are computed on first use and then reused for all clients.
+    """
+    __slots__ = ("event", "delta", "event_id", "area_id", "trace", "_json", "_sse", "_msgpack")
+
+    def __init__(self, event: dict, delta: Optional[dict] = None, event_id: Optional[str] = None,
+                 area_id: Optional[str] = None, trace: Optional[Trace] = None):
+        self.event = event
+        self.event_id = event_id
+        self.area_id = area_id
+        self.trace = trace
+        # attribute-diff variant of the same change, for subscribers in delta mode
+        self.delta: Optional[Frame] = Frame(delta, event_id=event_id, area_id=area_id, trace=trace) if delta is not None else None
+        self._json: Optional[bytes] = None
+        self._sse: Optional[bytes] = None
+        self._msgpack: Optional[bytes] = None
+
+    def relabel(self, event_id: Optional[str]) -> "Frame":
+        """The same event under another id (encodings are not shared with the original)."""
+        if event_id == self.event_id:
+            return self
+        frame = Frame(self.event, event_id=event_id, area_id=self.area_id, trace=self.trace)
+        frame.delta = self.delta.relabel(event_id) if self.delta is not None else None
+        return frame
+
+    @property
+    def entity_id(self) -> Optional[str]:
+        return (self.event.get("data") or {}).get("entity_id")
+
+    @property
+    def json(self) -> bytes:
+        if self._json is None:
+            self._json = orjson.dumps(self._with_id())
+        return self._json
+
+    @property
+    def msgpack(self) -> bytes:
+        if self._msgpack is None:
+            self._msgpack = msgpack.packb(self._with_id())
+        return self._msgpack
+
+    def _with_id(self) -> dict:
+        return {**self.event, "id": self.event_id} if self.event_id else self.event
+
+    @property
+    def sse(self) -> bytes:
+        if self._sse is None:
+            data = orjson.dumps(self.event["data"]) if "data" in self.event else self.json
+            head = b"id: " + self.event_id.encode() + b"\r\n" if self.event_id else b""
+            self._sse = head + b"event: " + self.event.get("event", "message").encode() + b"\r\ndata: " + data + b"\r\n\r\n"
+        return self._sse
+
+class SubscriberClosed(Exception):
+    """Raised by Subscriber.get once a subscriber has been disconnected."""
+
+class Subscriber:
+    """Bounded per-client queue. push() never blocks; on overflow the policy decides:
+    drop_oldest evicts the head, coalesce keeps only the latest event per entity_id
+    (and then evicts the head), disconnect closes the subscriber.
+    In delta mode a subscriber gets delta frames, except for entities whose
+    intermediate changes it lost to coalescing or dropping: those get a full frame.
+    """
+    _ids = itertools.count(1)
+
+    def __init__(self, maxsize: int, policy: str, entity_ids: Iterable[str] = (), domains: Iterable[str] = (),
+                 areas: Iterable[str] = (), patterns: Iterable[str] = (), delta: bool = False):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {policy}")
+        self.id = next(self._ids)
+        self.maxsize = maxsize
+        self.policy = policy
+        # key -> (enqueued_at, frame); key is the entity_id when coalescing, else a sequence number
+        self._items: "OrderedDict[Any, tuple]" = OrderedDict()
+        self._seq = itertools.count()
+        self._wake = asyncio.Event()
+        self.closed = False
+        self.delivered = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.delta = delta
+        self._stale: Set[str] = set()
+        # routing filters; a subscriber with none receives everything, otherwise any match counts
+        self.entity_ids = set(entity_ids)
+        self.domains = set(domains)
+        self.areas = set(areas)
+        self.patterns = list(patterns)
+
+    @property
+    def unfiltered(self) -> bool:
+        return not (self.entity_ids or self.domains or self.areas or self.patterns)
+
+    def push(self, frame: Frame):
+        if self.closed:
+            return
+        key = None
+        if self.policy == "coalesce":
+            key = frame.entity_id
+            if key is not None and key in self._items:
+                # keep the queued slot (moving to the tail would starve busy entities) and its
+                # event id, so delivered ids stay monotonic for Last-Event-ID
+                enqueued, queued = self._items[key]
+                self._items[key] = (enqueued, frame.relabel(queued.event_id))
+                self.coalesced += 1
+                if self.delta:
+                    self._stale.add(key)
+                return
+        if len(self._items) >= self.maxsize:
+            self.dropped += 1
+            if self.policy == "disconnect":
+                self.close()
+                return
+            lost = self._items.popitem(last=False)[1][1]
+            if self.delta and lost.entity_id is not None:
+                self._stale.add(lost.entity_id)
+        self._items[key if key is not None else next(self._seq)] = (time.monotonic(), frame)
+        self._wake.set()
+
+    async def get(self) -> Frame:
+        while not self._items:
+            if self.closed:
+                raise SubscriberClosed()
+            self._wake.clear()
+            await self._wake.wait()
+        self.delivered += 1
+        enqueued, frame = self._items.popitem(last=False)[1]
+        if frame.trace is not None:
+            frame.trace.span("queue", enqueued, subscriber=self.id)
+        if self.delta:
+            eid = frame.entity_id
+            if frame.delta is not None and eid not in self._stale:
+                return frame.delta
+            self._stale.discard(eid)
+        return frame
+
+    def matches(self, entity_id: str, area_id: Optional[str] = None) -> bool:
+        if self.unfiltered:
+            return True
+        return (entity_id in self.entity_ids
+                or entity_id.split(".",1)[0] in self.domains
+                or (area_id is not None and area_id in self.areas)
+                or any(fnmatch.fnmatchcase(entity_id, p) for p in self.patterns))
+
+    def close(self):
+        self.closed = True
+        self._items.clear()
+        self._wake.set()
+
+    def stats(self) -> Dict[str, Any]:
+        lag = (time.monotonic() - next(iter(self._items.values()))[0]) * 1000 if self._items else 0.0
+        return {
+            "id": self.id,
+            "policy": self.policy,
+            "depth": len(self._items),
+            "lag_ms": round(lag, 1),
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "closed": self.closed,
+            "delta": self.delta,
+            "filters": None if self.unfiltered else {
+                "entity_ids": sorted(self.entity_ids), "domains": sorted(self.domains),
+                "areas": sorted(self.areas), "patterns": self.patterns,
+            },
+        }
 
 class Broadcaster:
+    """Routes each event through indexes (entity_id, domain, area -> subscribers), so
+    publish cost scales with the subscribers that match rather than with all of them.
+
+    Every event gets the id "<epoch>.<seq>" (seq is monotonic, epoch is fixed per
+    process) and the last SSE_REPLAY_BUFFER frames are kept, so a reconnecting client
+    can be replayed exactly what it missed.
+    """
     def __init__(self):
-        self._queues = set()
+        self._subs: Dict[int, Subscriber] = {}
+        self._all: Set[int] = set()
+        self._by_entity: Dict[str, Set[int]] = {}
+        self._by_domain: Dict[str, Set[int]] = {}
+        self._by_area: Dict[str, Set[int]] = {}
+        self._pattern_subs: Set[int] = set()
+        # entity_id -> subscribers whose glob patterns match it; reset when subscriptions change
+        self._pattern_cache: Dict[str, List[int]] = {}
+        self.published = 0
+        self.epoch = format(int(time.time() * 1000), "x")
+        self.seq = 0
+        self._ring: deque = deque(maxlen=settings.SSE_REPLAY_BUFFER)
+        self.replays = 0
+        self.snapshots = 0
+        # builds the full-state event a (re)starting subscriber resyncs from; set by the app
+        self.snapshot: Optional[Callable[[Subscriber], dict]] = None
+
+    def _index(self, sub: Subscriber, add: bool):
+        def upd(index: Dict[str, Set[int]], keys: Iterable[str]):
+            for k in keys:
+                if add:
+                    index.setdefault(k, set()).add(sub.id)
+                else:
+                    ids = index.get(k)
+                    if ids is not None:
+                        ids.discard(sub.id)
+                        if not ids:
+                            del index[k]
+        if sub.unfiltered:
+            (self._all.add if add else self._all.discard)(sub.id)
+        upd(self._by_entity, sub.entity_ids)
+        upd(self._by_domain, sub.domains)
+        upd(self._by_area, sub.areas)
+        if sub.patterns:
+            (self._pattern_subs.add if add else self._pattern_subs.discard)(sub.id)
+            self._pattern_cache.clear()
+
+    def subscribe(self, policy: Optional[str] = None, maxsize: Optional[int] = None, **filters) -> Subscriber:
+        sub = Subscriber(maxsize or settings.SSE_QUEUE_SIZE, policy or settings.SSE_OVERFLOW_POLICY, **filters)
+        self._subs[sub.id] = sub
+        self._index(sub, True)
+        return sub
 
-    async def register(self) -> AsyncIterator[dict]:
-        q: asyncio.Queue = asyncio.Queue()
-        self._queues.add(q)
+    def unsubscribe(self, sub: Subscriber):
+        if self._subs.pop(sub.id, None) is not None:
+            self._index(sub, False)
+        sub.close()
+
+    def _missed(self, sub: Subscriber, last_event_id: str) -> Optional[List[Frame]]:
+        """Frames after last_event_id that sub matches; None if they are no longer all buffered."""
+        epoch, _, seq = last_event_id.partition(".")
+        if epoch != self.epoch or not seq.isdigit() or int(seq) > self.seq:
+            return None
+        seq = int(seq)
+        if seq < self.seq and (not self._ring or self._ring[0][0] > seq + 1):
+            return None
+        missed = [f for n, f in self._ring if n > seq and sub.matches(f.entity_id or "", f.area_id)]
+        return missed if len(missed) <= sub.maxsize else None
+
+    def _snapshot_frame(self, sub: Subscriber) -> Frame:
+        self.snapshots += 1
+        return Frame(self.snapshot(sub), event_id=f"{self.epoch}.{self.seq}")
+
+    def start(self, sub: Subscriber, last_event_id: Optional[str] = None):
+        """Prime a fresh subscriber: replay what it missed since last_event_id, or a
+        snapshot if the gap is too large (or it is a new delta-mode client).
+        Runs synchronously right after subscribe, so nothing is lost or duplicated.
+        """
+        missed = self._missed(sub, last_event_id) if last_event_id else None
+        if missed is not None:
+            self.replays += 1
+            for f in missed:
+                sub.push(f)
+        elif (last_event_id or sub.delta) and self.snapshot is not None:
+            sub.push(self._snapshot_frame(sub))
+
+    async def register(self, policy: Optional[str] = None, last_event_id: Optional[str] = None,
+                       **filters) -> AsyncIterator[Frame]:
+        sub = self.subscribe(policy, **filters)
+        self.start(sub, last_event_id)
         try:
             while True:
-                yield await q.get()
+                yield await sub.get()
+        except SubscriberClosed:
+            return
         finally:
-            self._queues.discard(q)
+            self.unsubscribe(sub)
+
+    def _pattern_matches(self, entity_id: str) -> List[int]:
+        hit = self._pattern_cache.get(entity_id)
+        if hit is None:
+            hit = [sid for sid in self._pattern_subs
+                   if any(fnmatch.fnmatchcase(entity_id, p) for p in self._subs[sid].patterns)]
+            self._pattern_cache[entity_id] = hit
+        return hit
+
+    def publish(self, event: dict, area_id: Optional[str] = None, delta: Optional[dict] = None,
+                trace: Optional[Trace] = None):
+        """Non-blocking fan-out to matching subscribers; never awaits a slow client.
+        Events without an entity_id go to everyone.
+        """
+        self.published += 1
+        self.seq += 1
+        frame = Frame(event, delta, f"{self.epoch}.{self.seq}", area_id, trace)
+        self._ring.append((self.seq, frame))
+        subs = self._subs
+        entity_id = frame.entity_id
+        if entity_id is None:
+            for sub in list(subs.values()):
+                sub.push(frame)
+            BROADCAST_FANOUT.observe(len(subs))
+            return
+        for sid in list(self._all):
+            subs[sid].push(frame)
+        matched: Set[int] = set()
+        ids = self._by_entity.get(entity_id)
+        if ids:
+            matched.update(ids)
+        ids = self._by_domain.get(entity_id.split(".",1)[0])
+        if ids:
+            matched.update(ids)
+        if area_id is not None:
+            ids = self._by_area.get(area_id)
+            if ids:
+                matched.update(ids)
+        if self._pattern_subs:
+            matched.update(self._pattern_matches(entity_id))
+        for sid in matched:
+            subs[sid].push(frame)
+        BROADCAST_FANOUT.observe(len(self._all) + len(matched))
+
+    async def broadcast(self, event: dict, area_id: Optional[str] = None, delta: Optional[dict] = None,
+                        trace: Optional[Trace] = None):
+        self.publish(event, area_id, delta, trace)
 
-    async def broadcast(self, event: dict):
-        for q in list(self._queues):
-            await q.put(event)
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "published": self.published,
+            "last_event_id": f"{self.epoch}.{self.seq}",
+            "replay_buffered": len(self._ring),
+            "replays": self.replays,
+            "snapshots": self.snapshots,
+            "subscribers": [s.stats() for s in self._subs.values()],
+        }
 
-broadcaster = Broadcaster()
\ No newline at end of file
+broadcaster = Broadcaster()
+Gauge("bridge_broadcast_subscribers", "Connected event subscribers (SSE and WebSocket)", lambda: len(broadcaster._subs))
+Gauge("bridge_broadcast_queue_depth", "Events queued across all subscribers",
+      lambda: sum(len(s._items) for s in broadcaster._subs.values()))
+Gauge("bridge_broadcast_queue_depth_max", "Deepest subscriber queue",
+      lambda: max((len(s._items) for s in broadcaster._subs.values()), default=0))
@@ -0,0 +1,90 @@
+# In-memory search index for entity lookups (domain filter + typeahead).
+import bisect, re
+from typing import Dict, Iterable, List, Optional, Set
+
+_SPLIT = re.compile(r"[^0-9a-z]+")
+
+def tokenize(text: Optional[str]) -> Set[str]:
+    return {t for t in _SPLIT.split((text or "").lower()) if t}
+
+class SearchIndex:
+    """domain -> ids plus a token -> ids map over entity_id, friendly_name and aliases.
+    Prefix lookups bisect a sorted token list, which is only re-sorted when the
+    token vocabulary changes (not on ordinary state updates).
+    """
+    def __init__(self):
+        self.by_domain: Dict[str, Set[str]] = {}
+        self._postings: Dict[str, Set[str]] = {}
+        self._entity_tokens: Dict[str, Set[str]] = {}
+        self._names: Dict[str, Optional[str]] = {}
+        self.aliases: Dict[str, Set[str]] = {}
+        self._sorted: List[str] = []
+        self._dirty = False
+
+    def _reindex(self, eid: str):
+        tokens = tokenize(eid) | tokenize(self._names.get(eid))
+        for a in self.aliases.get(eid, ()):
+            tokens |= tokenize(a)
+        old = self._entity_tokens.get(eid, set())
+        for t in old - tokens:
+            ids = self._postings[t]
+            ids.discard(eid)
+            if not ids:
+                del self._postings[t]
+                self._dirty = True
+        for t in tokens - old:
+            if t not in self._postings:
+                self._postings[t] = set()
+                self._dirty = True
+            self._postings[t].add(eid)
+        self._entity_tokens[eid] = tokens
+
+    def update(self, eid: str, friendly_name: Optional[str]):
+        if eid in self._names and self._names[eid] == friendly_name:
+            return  # the common case: a state change with the same name
+        self._names[eid] = friendly_name
+        self.by_domain.setdefault(eid.split(".",1)[0], set()).add(eid)
+        self._reindex(eid)
+
+    def remove(self, eid: str):
+        if eid not in self._names:
+            return
+        del self._names[eid]
+        ids = self.by_domain.get(eid.split(".",1)[0])
+        if ids is not None:
+            ids.discard(eid)
+            if not ids:
+                del self.by_domain[eid.split(".",1)[0]]
+        for t in self._entity_tokens.pop(eid, ()):
+            ids = self._postings[t]
+            ids.discard(eid)
+            if not ids:
+                del self._postings[t]
+                self._dirty = True
+
+    def set_aliases(self, eid: str, aliases: Iterable[str]):
+        self.aliases[eid] = set(aliases)
+        if eid in self._names:
+            self._reindex(eid)
+
+    def _prefix(self, term: str) -> Set[str]:
+        if self._dirty:
+            self._sorted = sorted(self._postings)
+            self._dirty = False
+        i = bisect.bisect_left(self._sorted, term)
+        out: Set[str] = set()
+        while i < len(self._sorted) and self._sorted[i].startswith(term):
+            out |= self._postings[self._sorted[i]]
+            i += 1
+        return out
+
+    def search(self, q: Optional[str] = None, domain: Optional[str] = None) -> Set[str]:
+        """Ids whose tokens start with every term of q, optionally within one domain."""
+        sets = [self._prefix(t) for t in tokenize(q)]
+        if domain:
+            sets.append(self.by_domain.get(domain, set()))
+        if not sets:
+            return set(self._names)
+        # smallest-first keeps intersections cheap; intersection() always returns a new set
+        sets.sort(key=len)
+        return sets[0].intersection(*sets[1:])
@@ -5,5 +5,53 @@ class Settings(BaseSettings):
     HA_TOKEN: str
     DB_URL: str = "sqlite:///./data/bridge.db"
     LOG_LEVEL: str = "INFO"
+    # SQLite tuning, applied on every connection
+    DB_JOURNAL_MODE: str = "WAL"
+    DB_SYNCHRONOUS: str = "NORMAL"
+    DB_CACHE_SIZE: int = -16000  # negative = KiB
+    DB_MMAP_SIZE: int = 134217728
+    DB_BUSY_TIMEOUT_MS: int = 5000
+    # shared HA REST client
+    HA_TIMEOUT: float = 15.0
+    HA_CONNECT_TIMEOUT: float = 5.0
+    HA_MAX_CONNECTIONS: int = 20
+    HA_MAX_KEEPALIVE: int = 10
+    HA_KEEPALIVE_EXPIRY: float = 30.0
+    HA_HTTP2: bool = False
+    HA_GET_RETRIES: int = 2
+    HA_RETRY_BACKOFF: float = 0.25
+    # max concurrent HA service calls per batch command
+    COMMAND_CONCURRENCY: int = 8
+    # send commands/queries over the HA WebSocket, REST only as fallback
+    HA_WS_COMMANDS: bool = True
+    HA_WS_TIMEOUT: float = 10.0
+    # largest HA WebSocket frame accepted, in bytes (0 = no limit); registry lists grow with the install
+    HA_WS_MAX_SIZE: int = 0
+    # per-subscriber realtime queue: drop_oldest | coalesce | disconnect
+    SSE_QUEUE_SIZE: int = 1000
+    SSE_OVERFLOW_POLICY: str = "coalesce"
+    # recent events kept for Last-Event-ID replay
+    SSE_REPLAY_BUFFER: int = 5000
+    # numeric state history; retention in days per resolution (0 = keep forever)
+    HISTORY_ENABLED: bool = True
+    HISTORY_FLUSH_INTERVAL: float = 5.0
+    HISTORY_RAW_RETENTION_DAYS: int = 7
+    HISTORY_1M_RETENTION_DAYS: int = 35
+    HISTORY_1H_RETENTION_DAYS: int = 400
+    HISTORY_1D_RETENTION_DAYS: int = 0
+    # command audit log
+    AUDIT_FLUSH_INTERVAL: float = 2.0
+    AUDIT_BATCH_SIZE: int = 200
+    AUDIT_RETENTION_DAYS: int = 90
+    # metrics: interval of the event loop lag / throughput probe
+    METRICS_PROBE_INTERVAL: float = 0.5
+    # tracing: share of events/commands traced, threshold and size of the slow-trace ring
+    TRACE_SAMPLE_RATIO: float = 0.01
+    TRACE_SLOW_MS: float = 250
+    TRACE_BUFFER: int = 100
+    DEBUG_PROFILING: bool = False
+    # write-behind persistence of state_changed updates
+    PERSIST_FLUSH_INTERVAL: float = 1.0
+    PERSIST_BATCH_SIZE: int = 500
 
 settings = Settings()
\ No newline at end of file
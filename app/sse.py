@@ -1,13 +1,14 @@
 from sse_starlette.sse import EventSourceResponse
 from typing import AsyncIterator
-import asyncio, json
+import asyncio
+import orjson
 
 async def sse_stream(generator: AsyncIterator[dict]):
     async def event_publisher():
         async for ev in generator:
             yield {
                 "event": ev.get("event", "message"),
-                "data": json.dumps(ev["data"]) if "data" in ev else json.dumps(ev)
+                "data": orjson.dumps(ev["data"] if "data" in ev else ev).decode()
             }
             await asyncio.sleep(0)
     return EventSourceResponse(event_publisher(), ping=15)
\ No newline at end of file
@@ -1,71 +1,378 @@
-import asyncio, logging, uuid
-from typing import Dict, Any, List
-from sqlalchemy import select
-from sqlalchemy.orm import Session
-from .db import SessionLocal, engine
-from .models import Base, Area, Device, Entity, Alias, Audit
-from .ha_client import ws_messages, list_states, list_services
+import asyncio, logging, time, uuid
+from typing import Dict, Any, List, Optional
+from .db import db_worker
+from .models import Area, Device
+from .ha_client import ws_messages, ws_request, list_states, list_services
+from .persist import writer, delete_entities, replace_rows, init_schema, load_catalog
+from .search import SearchIndex
+from .capabilities import CapabilityIndex
+from .history import history
+from .settings import settings
+from .metrics import WS_MESSAGES, WS_PROCESSING
 
 log = logging.getLogger("state")
 
+def entity_view(eid: str, state: Optional[str], attrs: Dict[str, Any], friendly_name: Optional[str] = None) -> Dict[str, Any]:
+    """Plain-dict entity as served by the read endpoints."""
+    return {
+        "entity_id": eid,
+        "domain": eid.split(".",1)[0],
+        "friendly_name": friendly_name if friendly_name is not None else attrs.get("friendly_name"),
+        "state": state,
+        "attributes": attrs,
+        "device_id": None,
+        "area_id": None,
+    }
+
+REGISTRY_LISTS = ("area_registry/list", "device_registry/list", "entity_registry/list")
+REGISTRY_EVENTS = {
+    "area_registry_updated": "area_registry/list",
+    "device_registry_updated": "device_registry/list",
+    "entity_registry_updated": "entity_registry/list",
+}
+
+def attribute_delta(eid: str, prev: Optional[Dict[str, Any]], view: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Delta event against the previous view: only added/changed attributes and removed keys.
+    None when there is no previous state to diff against.
+    """
+    if prev is None:
+        return None
+    old, new = prev["attributes"] or {}, view["attributes"] or {}
+    return {
+        "event": "delta",
+        "data": {
+            "entity_id": eid,
+            "state": view["state"],
+            "set": {k: v for k, v in new.items() if k not in old or old[k] != v},
+            "unset": [k for k in old if k not in new],
+        },
+    }
+
 class Catalog:
     def __init__(self):
         self.services_cache: List[Dict[str, Any]] = []
+        # Authoritative entity state; SQLite only persists it.
+        self.entities: Dict[str, Dict[str, Any]] = {}
+        self.search = SearchIndex()
+        self.capabilities = CapabilityIndex()
+        # bumped on every store change; feeds ETags on the read API (epoch guards restarts)
+        self.epoch = format(int(time.time() * 1000), "x")
+        self.version = 0
+        self._sorted_ids: Optional[List[str]] = None
+        # HA registries (from the WS snapshot) and the placement indexes derived from them
+        self.areas: Dict[str, Dict[str, Any]] = {}
+        self.devices: Dict[str, Dict[str, Any]] = {}
+        self.entity_registry: Dict[str, Dict[str, Any]] = {}
+        self.by_area: Dict[str, set] = {}
+        self.by_device: Dict[str, set] = {}
+        self._registry_refresh: set = set()
 
     async def init_db(self):
-        Base.metadata.create_all(engine)
+        await db_worker.run(init_schema)
+        # Warm the store from the last persisted snapshot so reads work before the first sync
+        data = await db_worker.run(load_catalog)
+        for a in data["areas"]:
+            self.areas[a["id"]] = {"area_id": a["id"], "name": a["name"]}
+        for d in data["devices"]:
+            self.devices[d["id"]] = self._device_view(d["id"], d["name"], d["manufacturer"], d["model"], d["area_id"],
+                                                      d["hw_version"], d["sw_version"], d["identifiers"], d["connections"])
+        for e in data["entities"]:
+            # placement persisted by the last registry snapshot, until a fresh one arrives
+            if e["device_id"] or e["area_id"]:
+                self.entity_registry[e["id"]] = {"device_id": e["device_id"], "area_id": e["area_id"]}
+            self._put(e["id"], entity_view(e["id"], e["state"], e["attributes"] or {}, e["friendly_name"]))
+        aliases: Dict[str, List[str]] = {}
+        for a in data["aliases"]:
+            aliases.setdefault(a["entity_id"], []).append(a["alias"])
+        for eid, names in aliases.items():
+            self.search.set_aliases(eid, names)
+        log.info("Loaded %d entities from database", len(self.entities))
+
+    @staticmethod
+    def _device_view(did, name, manufacturer, model, area_id, hw_version, sw_version, identifiers, connections):
+        return {
+            "device_id": did, "name": name, "manufacturer": manufacturer, "model": model, "area_id": area_id,
+            "hw_version": hw_version, "sw_version": sw_version, "identifiers": identifiers, "connections": connections,
+        }
+
+    def _placement(self, eid: str):
+        """(device_id, area_id); an entity without its own area inherits its device's."""
+        reg = self.entity_registry.get(eid)
+        if reg is None:
+            return None, None
+        device_id = reg.get("device_id")
+        area_id = reg.get("area_id") or (self.devices.get(device_id) or {}).get("area_id")
+        return device_id, area_id
+
+    def _place(self, eid: str, device_id: Optional[str], area_id: Optional[str], old: Optional[Dict[str, Any]]):
+        if old is not None and (old["device_id"], old["area_id"]) == (device_id, area_id):
+            return
+        if old is not None:
+            for index, key in ((self.by_device, old["device_id"]), (self.by_area, old["area_id"])):
+                if key is not None:
+                    index.get(key, set()).discard(eid)
+        if device_id is not None:
+            self.by_device.setdefault(device_id, set()).add(eid)
+        if area_id is not None:
+            self.by_area.setdefault(area_id, set()).add(eid)
+
+    def _registry_columns(self, eid: str, view: Dict[str, Any]) -> Dict[str, Any]:
+        """Placement/registry columns for an entity's row, so state writes persist them too
+        (the registry snapshot can arrive before the entity is first stored).
+        """
+        reg = self.entity_registry.get(eid)
+        if reg is None:
+            return {}
+        # entries warmed from the database only carry placement; don't null the rest
+        return {"device_id": view["device_id"], "area_id": view["area_id"],
+                **{k: reg[k] for k in ("platform", "category", "name") if k in reg}}
+
+    def _put(self, eid: str, view: Dict[str, Any]):
+        old = self.entities.get(eid)
+        if old is None:
+            self._sorted_ids = None
+        view["device_id"], view["area_id"] = self._placement(eid)
+        self._place(eid, view["device_id"], view["area_id"], old)
+        self.entities[eid] = view
+        self.search.update(eid, view["friendly_name"])
+        self.version += 1
+
+    def _drop(self, eid: str):
+        old = self.entities.pop(eid, None)
+        if old is not None:
+            self._place(eid, None, None, old)
+            self._sorted_ids = None
+            self.search.remove(eid)
+            self.capabilities.forget(eid)
+            self.version += 1
+
+    def sorted_ids(self) -> List[str]:
+        if self._sorted_ids is None:
+            self._sorted_ids = sorted(self.entities)
+        return self._sorted_ids
+
+    def get(self, entity_id: str) -> Optional[Dict[str, Any]]:
+        return self.entities.get(entity_id)
+
+    def find(self, q: Optional[str] = None, domain: Optional[str] = None) -> List[str]:
+        """Matching entity ids, sorted (a stable order for cursor pagination)."""
+        if not q and not domain:
+            return self.sorted_ids()
+        return sorted(eid for eid in self.search.search(q, domain) if eid in self.entities)
+
+    def snapshot(self, sub) -> Dict[str, Any]:
+        """Full state of every entity the subscriber's filters match."""
+        return {
+            "event": "snapshot",
+            "data": {"entities": [e for e in self.entities.values() if sub.matches(e["entity_id"], e.get("area_id"))]},
+        }
+
+    def in_area(self, area_id: str) -> List[str]:
+        return sorted(self.by_area.get(area_id, ()))
+
+    def on_device(self, device_id: str) -> List[str]:
+        return sorted(self.by_device.get(device_id, ()))
+
+    async def _persist_registry(self, model, rows: List[Dict[str, Any]]):
+        # runs inline in ws_consumer: a failed write must not take the event stream down
+        try:
+            await db_worker.run(replace_rows, model, rows)
+        except Exception as e:
+            log.warning("Persisting %s registry failed: %s", model.__tablename__, e)
+
+    async def apply_registry(self, kind: str, items: List[Dict[str, Any]]):
+        """Store one registry snapshot (area/device/entity list) and re-derive entity placement."""
+        if kind == "area_registry/list":
+            self.areas = {a["area_id"]: {"area_id": a["area_id"], "name": a.get("name")} for a in items}
+            await self._persist_registry(Area, [{"id": a["area_id"], "name": a["name"] or a["area_id"]}
+                                                for a in self.areas.values()])
+        elif kind == "device_registry/list":
+            self.devices = {
+                d["id"]: self._device_view(
+                    d["id"], d.get("name_by_user") or d.get("name"), d.get("manufacturer"), d.get("model"),
+                    d.get("area_id"), d.get("hw_version"), d.get("sw_version"), d.get("identifiers"), d.get("connections"),
+                ) for d in items
+            }
+            await self._persist_registry(Device, [
+                {"id": d["device_id"], **{k: v for k, v in d.items() if k != "device_id"}} for d in self.devices.values()
+            ])
+        elif kind == "entity_registry/list":
+            old_registry = self.entity_registry
+            self.entity_registry = {
+                e["entity_id"]: {
+                    "device_id": e.get("device_id"), "area_id": e.get("area_id"), "platform": e.get("platform"),
+                    "category": e.get("entity_category"), "name": e.get("name") or e.get("original_name"),
+                } for e in items
+            }
+        else:
+            return
+        # Re-place every entity: a device moving areas moves all its entities.
+        moved = 0
+        for eid, view in self.entities.items():
+            device_id, area_id = self._placement(eid)
+            reg = self.entity_registry.get(eid) or {}
+            if kind == "entity_registry/list":
+                reg_changed = reg != old_registry.get(eid)
+            else:
+                reg_changed = False
+            if (device_id, area_id) != (view["device_id"], view["area_id"]) or reg_changed:
+                self._place(eid, device_id, area_id, view)
+                view["device_id"], view["area_id"] = device_id, area_id
+                writer.put({"id": eid, "device_id": device_id, "area_id": area_id, "platform": reg.get("platform"),
+                            "category": reg.get("category"), "name": reg.get("name")})
+                moved += 1
+        self.version += 1
+        log.info("Registry %s: %d items, %d entities re-placed", kind, len(items), moved)
 
-    async def full_sync(self):
-        # Hydrate entity states via REST
+    async def _refresh_registry(self, kind: str):
+        # registry events come in bursts; refetch the whole list once they settle
+        await asyncio.sleep(1.0)
+        self._registry_refresh.discard(kind)
+        try:
+            await self.apply_registry(kind, await ws_request({"type": kind}))
+        except Exception as e:
+            log.warning("Refreshing %s failed: %s", kind, e)
+
+    async def full_sync(self, broadcast_cb=None) -> Dict[str, Any]:
+        """Reconcile the store and database with /api/states in a few set-based steps.
+        Unchanged entities are skipped, changed ones bulk-upserted (and published through
+        broadcast_cb, so delta subscribers primed from the warm store catch up), vanished
+        ones deleted.
+        """
+        timings: Dict[str, float] = {}
+        t0 = time.perf_counter()
         states = await list_states()
-        with SessionLocal() as s:
-            for st in states:
-                eid = st["entity_id"]
-                attrs = st.get("attributes", {})
-                ent = s.get(Entity, eid) or Entity(id=eid)
-                ent.domain = eid.split(".",1)[0]
-                ent.friendly_name = attrs.get("friendly_name")
-                ent.attributes = attrs
-                ent.state = st.get("state")
-                s.merge(ent)
-            s.commit()
+        timings["fetch_ms"] = (time.perf_counter() - t0) * 1000
+
+        t0 = time.perf_counter()
+        seen = set()
+        changed: List[Dict[str, Any]] = []
+        for st in states:
+            eid = st["entity_id"]
+            seen.add(eid)
+            attrs = st.get("attributes", {})
+            cur = self.entities.get(eid)
+            if cur is not None and cur["state"] == st.get("state") and cur["attributes"] == attrs:
+                continue
+            view = entity_view(eid, st.get("state"), attrs)
+            self._put(eid, view)
+            if broadcast_cb is not None:
+                # published right after the store update, before any await lets a newer event in
+                await broadcast_cb({
+                    "event": "state",
+                    "data": {"entity_id": eid, "state": view["state"], "attributes": attrs},
+                }, area_id=view["area_id"], delta=attribute_delta(eid, cur, view))
+            changed.append({
+                "id": eid,
+                "domain": view["domain"],
+                "friendly_name": view["friendly_name"],
+                "state": view["state"],
+                "attributes": attrs,
+                **self._registry_columns(eid, view),
+            })
+        # An empty answer is far more likely an HA hiccup than an empty install.
+        removed = [eid for eid in self.entities if eid not in seen] if states else []
+        for eid in removed:
+            self._drop(eid)
+        timings["diff_ms"] = (time.perf_counter() - t0) * 1000
+
+        t0 = time.perf_counter()
+        # Route through the write-behind stage so a queued older event can't overwrite the snapshot
+        for row in changed:
+            writer.put(row)
+        await writer.flush()
+        if removed:
+            writer.discard(removed)
+            await db_worker.run(delete_entities, removed)
+        timings["write_ms"] = (time.perf_counter() - t0) * 1000
+
+        t0 = time.perf_counter()
         self.services_cache = await list_services()
-        log.info("Full sync: %d entities, %d service domains", len(states), len(self.services_cache))
+        self.capabilities.set_services(self.services_cache)
+        timings["services_ms"] = (time.perf_counter() - t0) * 1000
+
+        report = {
+            "entities": len(states),
+            "changed": len(changed),
+            "removed": len(removed),
+            "service_domains": len(self.services_cache),
+            **{k: round(v, 1) for k, v in timings.items()},
+        }
+        log.info("Full sync: %s", report)
+        return report
 
     async def ws_consumer(self, broadcast_cb):
         async for msg in ws_messages():
-            # registry lists are returned once after subscribe; treat them as snapshots
-            if msg.get("type") == "result" and isinstance(msg.get("result"), list):
-                # area/device/entity registries
-                # We only store areas minimally and entity->device bindings if available
-                pass  # Simplified: core functionality relies on /api/states already
-
-            if msg.get("type") == "event" and msg.get("event", {}).get("event_type") == "state_changed":
-                ev = msg["event"]["data"]
-                eid = ev["entity_id"]
-                new_state = ev.get("new_state")
-                if not new_state:
-                    continue
-                # Extract fields before closing session to avoid DetachedInstanceError
-                state_val = new_state.get("state")
-                attrs_val = new_state.get("attributes", {})
-
-                with SessionLocal() as s:
-                    ent = s.get(Entity, eid) or Entity(id=eid)
-                    ent.domain = eid.split(".",1)[0]
-                    ent.state = state_val
-                    ent.attributes = attrs_val
-                    s.merge(ent)
-                    s.commit()
-
-                # Now broadcast using plain dicts, not ORM object
-                await broadcast_cb({
-                    "event": "state",
-                    "data": {
-                        "entity_id": eid,
-                        "state": state_val,
-                        "attributes": attrs_val,
-                    },
-                })
-
-catalog = Catalog()
\ No newline at end of file
+            t0 = time.perf_counter()
+            kind = await self._handle_message(msg, broadcast_cb)
+            WS_MESSAGES.inc(kind)
+            WS_PROCESSING.observe(time.perf_counter() - t0, kind)
+
+    async def _handle_message(self, msg: Dict[str, Any], broadcast_cb) -> str:
+        """Apply one HA WebSocket message; returns its kind for the metrics."""
+        # registry lists are returned once after subscribe; treat them as snapshots
+        if msg.get("type") == "result" and msg.get("command") in REGISTRY_LISTS:
+            if msg.get("success"):
+                try:
+                    await self.apply_registry(msg["command"], msg.get("result") or [])
+                except Exception as e:
+                    log.warning("Applying %s failed: %s", msg["command"], e)
+            return "registry_list"
+
+        event_type = msg.get("event", {}).get("event_type") if msg.get("type") == "event" else None
+        kind = REGISTRY_EVENTS.get(event_type)
+        if kind is not None:
+            if kind not in self._registry_refresh:
+                self._registry_refresh.add(kind)
+                asyncio.create_task(self._refresh_registry(kind))
+            return "registry_event"
+
+        if event_type != "state_changed":
+            return "other"
+        ev = msg["event"]["data"]
+        eid = ev["entity_id"]
+        new_state = ev.get("new_state")
+        if not new_state:
+            return "state_changed"
+        trace = msg.get("_trace")
+        if trace is not None:
+            trace.attrs["entity_id"] = eid
+            trace.span("consume", trace.spans[-1][2])  # hand-off from the WS reader to this loop
+            stage = time.monotonic()
+        state_val = new_state.get("state")
+        attrs_val = new_state.get("attributes", {})
+        view = entity_view(eid, state_val, attrs_val)
+        prev = self.entities.get(eid)
+        self._put(eid, view)
+        if settings.HISTORY_ENABLED:
+            history.record(eid, state_val, new_state.get("last_updated"))
+
+        writer.put({
+            "id": eid,
+            "domain": view["domain"],
+            "friendly_name": view["friendly_name"],
+            "state": state_val,
+            "attributes": attrs_val,
+            **self._registry_columns(eid, view),
+        })
+
+        if trace is not None:
+            # in-memory store plus write-behind/history queueing; SQLite is written by the flushers
+            trace.span("store", stage)
+            stage = time.monotonic()
+
+        # Now broadcast using plain dicts, not ORM object
+        await broadcast_cb({
+            "event": "state",
+            "data": {
+                "entity_id": eid,
+                "state": state_val,
+                "attributes": attrs_val,
+            },
+        }, area_id=view.get("area_id"), delta=attribute_delta(eid, prev, view), trace=trace)
+        if trace is not None:
+            trace.span("publish", stage)
+            trace.finish()
+        return "state_changed"
+
+catalog = Catalog()
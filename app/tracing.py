@@ -0,0 +1,72 @@
+# Sampled per-event / per-command tracing. A sampled trace collects timed spans
+# (parse, store, publish, queue, write; plan, call_service) and is kept in a ring of
+# slow traces served at /debug/traces. Unsampled work only pays for one random() call.
+import itertools, random, time
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+from .settings import settings
+
+# a trace fans out to every subscriber; cap what one trace can hold
+MAX_SPANS = 64
+
+class Trace:
+    __slots__ = ("id", "name", "start", "end", "attrs", "spans", "kept")
+
+    def __init__(self, tid: int, name: str, start: float, attrs: Dict[str, Any]):
+        self.id = tid
+        self.name = name
+        self.start = start
+        self.end = start
+        self.attrs = attrs
+        self.spans: List[Tuple[str, float, float, Dict[str, Any]]] = []
+        self.kept = False
+
+    def span(self, name: str, start: float, end: Optional[float] = None, **attrs):
+        """Record a stage that ran from start to end (default now); times are time.monotonic()."""
+        if len(self.spans) < MAX_SPANS:
+            self.spans.append((name, start, time.monotonic() if end is None else end, attrs))
+
+    def finish(self):
+        """Mark the trace as (so far) complete; may be called again as later stages finish."""
+        self.end = max(self.end, time.monotonic())
+        tracer.finished(self)
+
+    @property
+    def total_ms(self) -> float:
+        return (self.end - self.start) * 1000
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "total_ms": round(self.total_ms, 3),
+            "attrs": self.attrs,
+            "spans": [{"name": n, "offset_ms": round((s - self.start) * 1000, 3), "ms": round((e - s) * 1000, 3), **a}
+                      for n, s, e, a in self.spans],
+        }
+
+class Tracer:
+    def __init__(self, buffer: int):
+        self._ids = itertools.count(1)
+        self.slow: "deque[Trace]" = deque(maxlen=buffer)
+        self.sampled = 0
+
+    def start(self, name: str, start: Optional[float] = None, **attrs) -> Optional[Trace]:
+        """A new trace for TRACE_SAMPLE_RATIO of calls, else None."""
+        ratio = settings.TRACE_SAMPLE_RATIO
+        if ratio <= 0 or (ratio < 1 and random.random() >= ratio):
+            return None
+        self.sampled += 1
+        return Trace(next(self._ids), name, time.monotonic() if start is None else start, attrs)
+
+    def finished(self, trace: Trace):
+        # kept by reference, so spans added by slower subscribers still show up
+        if not trace.kept and trace.total_ms >= settings.TRACE_SLOW_MS:
+            trace.kept = True
+            self.slow.append(trace)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"sample_ratio": settings.TRACE_SAMPLE_RATIO, "slow_ms": settings.TRACE_SLOW_MS,
+                "sampled": self.sampled, "slow_buffered": len(self.slow)}
+
+tracer = Tracer(settings.TRACE_BUFFER)
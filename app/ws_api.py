@@ -0,0 +1,170 @@
+# Client-facing WebSocket: multiplexes filtered event subscriptions and commands
+# over one connection, on top of the shared Broadcaster.
+import asyncio, logging, time
+from typing import Any, Dict, List, Optional
+import orjson
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from .realtime import broadcaster, Frame, Subscriber, SubscriberClosed, OVERFLOW_POLICIES
+from .commands import run_command, CommandError
+
+try:
+    import msgpack
+except ImportError:  # optional: only needed for ?format=msgpack
+    msgpack = None
+
+log = logging.getLogger("ws_api")
+
+router = APIRouter(prefix="/api/v1")
+
+def _msgpack_event(sid: int, frame: Frame) -> bytes:
+    # {"type": "event", "subscription": sid, "event": <frame>} spliced around the frame's
+    # shared msgpack encoding, so each event is still packed only once
+    return (b"\x83" + msgpack.packb("type") + msgpack.packb("event") + msgpack.packb("subscription")
+            + msgpack.packb(sid) + msgpack.packb("event") + frame.msgpack)
+
+def _str_list(msg: Dict[str, Any], key: str) -> List[str]:
+    value = msg.get(key) or []
+    if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+        raise ValueError(f"{key} must be a list of strings")
+    return value
+
+class ClientConnection:
+    def __init__(self, ws: WebSocket, fmt: str):
+        self.ws = ws
+        self.fmt = fmt
+        self.subs: Dict[int, Subscriber] = {}
+        self.pumps: Dict[int, asyncio.Task] = {}
+        self.tasks: set = set()
+        self._send_lock = asyncio.Lock()
+
+    async def _send_raw(self, data: bytes):
+        async with self._send_lock:
+            if self.fmt == "msgpack":
+                await self.ws.send_bytes(data)
+            else:
+                await self.ws.send_text(data.decode())
+
+    async def send(self, obj: Dict[str, Any]):
+        await self._send_raw(msgpack.packb(obj) if self.fmt == "msgpack" else orjson.dumps(obj))
+
+    def decode(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        if message.get("bytes") is not None:
+            return msgpack.unpackb(message["bytes"]) if self.fmt == "msgpack" else orjson.loads(message["bytes"])
+        return orjson.loads(message["text"])
+
+    async def _pump(self, sid: int, sub: Subscriber):
+        prefix = b'{"type":"event","subscription":' + str(sid).encode() + b',"event":'
+        try:
+            while True:
+                frame = await sub.get()
+                t0 = time.monotonic()
+                if self.fmt == "msgpack":
+                    await self._send_raw(_msgpack_event(sid, frame))
+                else:
+                    await self._send_raw(prefix + frame.json + b"}")
+                if frame.trace is not None:
+                    frame.trace.span("ws_write", t0, subscriber=sid)
+                    frame.trace.finish()
+        except SubscriberClosed:
+            # overflow policy disconnected this subscription; drop it from the routing indexes too
+            self.subs.pop(sid, None)
+            self.pumps.pop(sid, None)
+            broadcaster.unsubscribe(sub)
+            try:
+                await self.send({"type": "subscription_closed", "subscription": sid})
+            except (WebSocketDisconnect, RuntimeError):
+                pass
+        except (WebSocketDisconnect, RuntimeError):
+            # client went away mid-send; client_ws sees the disconnect and closes the connection
+            log.debug("subscription %s: client disconnected", sid)
+
+    def subscribe(self, msg: Dict[str, Any]) -> int:
+        policy, last_event_id = msg.get("overflow"), msg.get("last_event_id")
+        if policy and policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow must be one of {', '.join(OVERFLOW_POLICIES)}")
+        if last_event_id is not None and not isinstance(last_event_id, str):
+            raise ValueError("last_event_id must be a string")
+        filters = {key: _str_list(msg, key) for key in ("entity_ids", "domains", "areas", "patterns")}
+        sub = broadcaster.subscribe(policy, delta=bool(msg.get("delta")), **filters)
+        broadcaster.start(sub, last_event_id)
+        self.subs[sub.id] = sub
+        self.pumps[sub.id] = asyncio.create_task(self._pump(sub.id, sub))
+        return sub.id
+
+    def unsubscribe(self, sid: int) -> bool:
+        sub = self.subs.pop(sid, None)
+        if sub is None:
+            return False
+        broadcaster.unsubscribe(sub)
+        self.pumps.pop(sid).cancel()
+        return True
+
+    async def command(self, mid: Any, msg: Dict[str, Any]):
+        try:
+            entity_id, properties, actor = msg["entity_id"], msg.get("properties") or {}, msg.get("actor") or "ws"
+            if not isinstance(entity_id, str) or not isinstance(properties, dict) or not isinstance(actor, str):
+                raise CommandError("entity_id and actor must be strings, properties an object")
+            body = await run_command(entity_id, properties, actor)
+            await self.send({"id": mid, "type": "result", "success": body["status"] == "ok", "result": body})
+        except (CommandError, KeyError) as e:
+            await self.send({"id": mid, "type": "result", "success": False, "error": str(e)})
+
+    async def handle(self, msg: Any):
+        if not isinstance(msg, dict):
+            await self.send({"type": "result", "success": False, "error": "Message must be an object"})
+            return
+        mid, kind = msg.get("id"), msg.get("type")
+        if kind == "command":
+            # run concurrently so a slow HA call never stalls event delivery or other commands
+            t = asyncio.create_task(self.command(mid, msg))
+            self.tasks.add(t)
+            t.add_done_callback(self.tasks.discard)
+            return
+        try:
+            if kind == "subscribe":
+                result: Any = {"subscription": self.subscribe(msg)}
+            elif kind == "unsubscribe":
+                sid = msg.get("subscription")
+                if not isinstance(sid, int) or not self.unsubscribe(sid):
+                    raise ValueError("Unknown subscription")
+                result = None
+            elif kind == "ping":
+                result = "pong"
+            else:
+                raise ValueError(f"Unknown message type {kind}")
+        except ValueError as e:
+            await self.send({"id": mid, "type": "result", "success": False, "error": str(e)})
+            return
+        await self.send({"id": mid, "type": "result", "success": True, "result": result})
+
+    def close(self):
+        for sid in list(self.subs):
+            self.unsubscribe(sid)
+        for t in self.tasks:
+            t.cancel()
+
+@router.websocket("/ws")
+async def client_ws(ws: WebSocket, format: Optional[str] = "json"):
+    if format not in ("json", "msgpack"):
+        await ws.close(code=1003, reason="format must be json or msgpack")
+        return
+    if format == "msgpack" and msgpack is None:
+        await ws.close(code=1003, reason="msgpack not installed on the bridge")
+        return
+    await ws.accept()
+    conn = ClientConnection(ws, format)
+    try:
+        while True:
+            message = await ws.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            try:
+                msg = conn.decode(message)
+            except Exception:
+                await conn.send({"type": "result", "success": False, "error": "Malformed message"})
+                continue
+            await conn.handle(msg)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        conn.close()
@@ -0,0 +1,209 @@
+# In-process fake Home Assistant for benchmarks: REST /api/states, /api/services and
+# /api/services/{domain}/{service}, plus the /api/websocket auth + subscribe_events flow,
+# the registry lists and the get_states/get_services/call_service commands the bridge uses.
+import asyncio, random, time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set
+import orjson
+from fastapi import FastAPI, Request, Response, WebSocket, WebSocketDisconnect
+
+AREAS = ["kitchen", "living_room", "bedroom", "office", "garage", "hall", "bathroom", "garden"]
+
+SERVICES = {
+    # light.turn_on groups its optional fields in a collapsible section, like HA does
+    "light": {"turn_on": {"fields": {"transition": {},
+                                     "advanced_fields": {"collapsed": True, "fields": {
+                                         "brightness": {}, "color_temp": {}, "hs_color": {}}}}},
+              "turn_off": {"fields": {"transition": {}}}, "toggle": {"fields": {}}},
+    "switch": {"turn_on": {"fields": {}}, "turn_off": {"fields": {}}, "toggle": {"fields": {}}},
+    "climate": {"set_hvac_mode": {"fields": {"hvac_mode": {}}}, "set_temperature": {"fields": {"temperature": {}}},
+                "set_fan_mode": {"fields": {"fan_mode": {}}}},
+    "homeassistant": {"update_entity": {"fields": {}}},
+}
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+def make_states(count: int) -> Dict[str, Dict[str, Any]]:
+    """A deterministic mix of lights, switches, numeric sensors and thermostats."""
+    states: Dict[str, Dict[str, Any]] = {}
+    now = _now()
+    for i in range(count):
+        kind = ("light", "light", "sensor", "sensor", "switch", "climate")[i % 6]
+        eid = f"{kind}.bench_{i}"
+        if kind == "light":
+            attrs = {"friendly_name": f"Bench light {i}", "supported_color_modes": ["color_temp", "hs"],
+                     "min_mireds": 153, "max_mireds": 500, "brightness": 128, "color_temp": 300}
+            state = "on"
+        elif kind == "sensor":
+            attrs = {"friendly_name": f"Bench sensor {i}", "unit_of_measurement": "°C", "device_class": "temperature"}
+            state = "21.5"
+        elif kind == "switch":
+            attrs = {"friendly_name": f"Bench switch {i}"}
+            state = "off"
+        else:
+            attrs = {"friendly_name": f"Bench thermostat {i}", "supported_features": 9, "hvac_modes": ["off", "heat"],
+                     "fan_modes": ["auto", "low"], "min_temp": 7, "max_temp": 30, "temperature": 20}
+            state = "heat"
+        states[eid] = {"entity_id": eid, "state": state, "attributes": attrs,
+                       "last_changed": now, "last_updated": now, "context": {"id": f"ctx{i}"}}
+    return states
+
+class FakeHA:
+    def __init__(self, entity_count: int):
+        self.states = make_states(entity_count)
+        self.clients: Set["_Client"] = set()
+        self.subscribed = asyncio.Event()
+        self.service_calls = 0
+        self.app = self._build()
+
+    # --- event generation -------------------------------------------------
+    def change(self, entity_id: str, bench_ts: Optional[float] = None) -> Dict[str, Any]:
+        """Mutate one entity like a device would; bench_ts (perf_counter) lets subscribers measure latency."""
+        old = self.states[entity_id]
+        attrs = dict(old["attributes"])
+        domain = entity_id.split(".", 1)[0]
+        if domain == "sensor":
+            state = f"{random.uniform(15, 25):.2f}"
+        elif domain == "light":
+            state = "on"
+            attrs["brightness"] = random.randint(1, 255)
+        elif domain == "climate":
+            state = old["state"]
+            attrs["current_temperature"] = round(random.uniform(18, 22), 1)
+        else:
+            state = "off" if old["state"] == "on" else "on"
+        if bench_ts is not None:
+            attrs["bench_ts"] = bench_ts
+        now = _now()
+        new = {**old, "state": state, "attributes": attrs, "last_updated": now,
+               "last_changed": now if state != old["state"] else old["last_changed"]}
+        self.states[entity_id] = new
+        return {"event_type": "state_changed", "data": {"entity_id": entity_id, "old_state": old, "new_state": new},
+                "origin": "LOCAL", "time_fired": now}
+
+    async def emit(self, event: Dict[str, Any]):
+        for c in list(self.clients):
+            await c.event(event)
+
+    async def stream(self, count: int, rate: float = 0, bench_ts: bool = False, ids: Optional[List[str]] = None) -> float:
+        """Emit count state_changed events (rate=0: as fast as possible); returns the send duration."""
+        ids = ids or list(self.states)
+        t0 = time.perf_counter()
+        batch = max(1, int(rate / 100)) if rate else 200
+        for n in range(count):
+            eid = ids[n % len(ids)]
+            await self.emit(self.change(eid, time.perf_counter() if bench_ts else None))
+            if (n + 1) % batch == 0:
+                if rate:
+                    # pace in ~10 ms slices so the send loop keeps up with the target rate
+                    delay = t0 + (n + 1) / rate - time.perf_counter()
+                    await asyncio.sleep(max(0.0, delay))
+                else:
+                    await asyncio.sleep(0)
+        return time.perf_counter() - t0
+
+    # --- registries -------------------------------------------------------
+    def registry(self, kind: str) -> List[Dict[str, Any]]:
+        if kind == "area_registry/list":
+            return [{"area_id": a, "name": a.replace("_", " ").title()} for a in AREAS]
+        if kind == "device_registry/list":
+            return []
+        return [{"entity_id": eid, "device_id": None, "area_id": AREAS[i % len(AREAS)]}
+                for i, eid in enumerate(self.states)]
+
+    def services_list(self) -> List[Dict[str, Any]]:
+        return [{"domain": d, "services": s} for d, s in SERVICES.items()]
+
+    async def call(self, domain: str, service: str, data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        self.service_calls += 1
+        ids = data.get("entity_id") or []
+        ids = [ids] if isinstance(ids, str) else ids
+        changed = []
+        for eid in ids:
+            if eid in self.states:
+                ev = self.change(eid)
+                changed.append(ev["data"]["new_state"])
+                await self.emit(ev)
+        return changed
+
+    # --- HTTP / WS --------------------------------------------------------
+    def _build(self) -> FastAPI:
+        app = FastAPI()
+
+        @app.get("/api/states")
+        async def states():
+            return Response(orjson.dumps(list(self.states.values())), media_type="application/json")
+
+        @app.get("/api/services")
+        async def services():
+            return Response(orjson.dumps(self.services_list()), media_type="application/json")
+
+        @app.post("/api/services/{domain}/{service}")
+        async def call_service(domain: str, service: str, request: Request):
+            data = orjson.loads(await request.body() or b"{}")
+            return Response(orjson.dumps(await self.call(domain, service, data)), media_type="application/json")
+
+        @app.websocket("/api/websocket")
+        async def websocket(ws: WebSocket):
+            await ws.accept()
+            client = _Client(self, ws)
+            try:
+                await client.run()
+            except WebSocketDisconnect:
+                pass
+            finally:
+                self.clients.discard(client)
+
+        return app
+
+class _Client:
+    def __init__(self, ha: FakeHA, ws: WebSocket):
+        self.ha = ha
+        self.ws = ws
+        self.state_sub: Optional[int] = None
+        self._lock = asyncio.Lock()
+
+    async def send(self, obj: Dict[str, Any]):
+        async with self._lock:
+            await self.ws.send_text(orjson.dumps(obj).decode())
+
+    async def event(self, event: Dict[str, Any]):
+        if self.state_sub is not None:
+            await self.send({"id": self.state_sub, "type": "event", "event": event})
+
+    async def result(self, mid: int, result: Any = None, success: bool = True):
+        msg: Dict[str, Any] = {"id": mid, "type": "result", "success": success, "result": result}
+        if not success:
+            msg["error"] = {"code": "unknown_command", "message": "Unknown command."}
+        await self.send(msg)
+
+    async def run(self):
+        await self.send({"type": "auth_required", "ha_version": "bench"})
+        auth = orjson.loads(await self.ws.receive_text())
+        if auth.get("type") != "auth" or not auth.get("access_token"):
+            await self.send({"type": "auth_invalid", "message": "Invalid access token"})
+            return
+        await self.send({"type": "auth_ok", "ha_version": "bench"})
+        self.ha.clients.add(self)
+        while True:
+            msg = orjson.loads(await self.ws.receive_text())
+            mid, kind = msg.get("id"), msg.get("type")
+            if kind == "subscribe_events":
+                if msg.get("event_type") == "state_changed":
+                    self.state_sub = mid
+                    self.ha.subscribed.set()
+                await self.result(mid)
+            elif kind in ("area_registry/list", "device_registry/list", "entity_registry/list"):
+                await self.result(mid, self.ha.registry(kind))
+            elif kind == "get_states":
+                await self.result(mid, list(self.ha.states.values()))
+            elif kind == "get_services":
+                await self.result(mid, SERVICES)
+            elif kind == "call_service":
+                data = {**(msg.get("service_data") or {}), **(msg.get("target") or {})}
+                # answer first, like HA, then let the resulting state_changed follow
+                await self.result(mid, {"context": {"id": f"bench{mid}"}})
+                await self.ha.call(msg["domain"], msg["service"], data)
+            else:
+                await self.result(mid, success=False)
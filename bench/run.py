@@ -0,0 +1,187 @@
+# Benchmark harness: runs the bridge against the in-process fake HA and reports
+#   full_sync duration (cold, unchanged, partly changed), sustained state_changed
+#   throughput through Catalog.ws_consumer, SSE fan-out latency at N subscribers and
+#   command round-trip latency.
+# Usage: python -m bench.run [--entities 5000] [--events 20000] [--subscribers 50] ... [--json]
+# Everything shares one event loop, so absolute numbers include the clients' own cost;
+# compare runs on the same machine.
+import argparse, asyncio, os, socket, statistics, sys, tempfile, time
+from typing import Any, Dict, List
+import httpx, orjson, uvicorn
+from .fake_ha import FakeHA
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _summary(samples: List[float]) -> Dict[str, Any]:
+    """Latency percentiles in ms."""
+    if not samples:
+        return {"n": 0}
+    ms = sorted(x * 1000 for x in samples)
+    pick = lambda q: round(ms[min(len(ms) - 1, int(q * len(ms)))], 3)
+    return {"n": len(ms), "mean": round(statistics.fmean(ms), 3), "p50": pick(0.5), "p95": pick(0.95),
+            "p99": pick(0.99), "max": round(ms[-1], 3)}
+
+async def _serve(app, port: int):
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.01)
+    return server, task
+
+async def _until(cond, timeout: float, what: str):
+    deadline = time.perf_counter() + timeout
+    while not cond():
+        if time.perf_counter() > deadline:
+            raise TimeoutError(f"timed out waiting for {what}")
+        await asyncio.sleep(0.005)
+
+async def bench_full_sync(fake: FakeHA, changed_ratio: float) -> Dict[str, Any]:
+    from app.state import catalog
+    from app.ha_client import start_http, stop_http
+    await start_http()
+    await catalog.init_db()
+    out = {}
+    t0 = time.perf_counter()
+    out["cold"] = {**await catalog.full_sync(), "total_ms": round((time.perf_counter() - t0) * 1000, 1)}
+    t0 = time.perf_counter()
+    out["unchanged"] = {**await catalog.full_sync(), "total_ms": round((time.perf_counter() - t0) * 1000, 1)}
+    ids = list(fake.states)
+    for eid in ids[:int(len(ids) * changed_ratio)]:
+        fake.change(eid)
+    t0 = time.perf_counter()
+    out[f"changed_{int(changed_ratio * 100)}pct"] = {**await catalog.full_sync(),
+                                                    "total_ms": round((time.perf_counter() - t0) * 1000, 1)}
+    await stop_http()
+    return out
+
+async def bench_events(fake: FakeHA, count: int, rate: float) -> Dict[str, Any]:
+    from app.metrics import WS_MESSAGES
+    key = ("state_changed",)
+    base = WS_MESSAGES.values.get(key, 0)
+    t0 = time.perf_counter()
+    send_s = await fake.stream(count, rate)
+    await _until(lambda: WS_MESSAGES.values.get(key, 0) >= base + count, 120, "ws_consumer to drain")
+    total = time.perf_counter() - t0
+    return {"events": count, "target_rate": rate or "max", "send_s": round(send_s, 3), "total_s": round(total, 3),
+            "events_per_sec": round(count / total, 1), "drain_lag_ms": round((total - send_s) * 1000, 1)}
+
+async def bench_sse(fake: FakeHA, base_url: str, subscribers: int, count: int, rate: float) -> Dict[str, Any]:
+    from app.realtime import broadcaster
+    latencies: List[float] = []
+    received = [0]
+    ids = [eid for eid in fake.states if eid.startswith("light.")]
+
+    async def subscriber(client: httpx.AsyncClient):
+        async with client.stream("GET", "/api/v1/status/stream", params={"domain": "light"}) as r:
+            async for line in r.aiter_lines():
+                if line.startswith("data: "):
+                    ts = (orjson.loads(line[6:]).get("attributes") or {}).get("bench_ts")
+                    if ts is not None:
+                        latencies.append(time.perf_counter() - ts)
+                        received[0] += 1
+
+    limits = httpx.Limits(max_connections=subscribers + 4, max_keepalive_connections=subscribers + 4)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=None) as client:
+        before = len(broadcaster.stats()["subscribers"])
+        tasks = [asyncio.create_task(subscriber(client)) for _ in range(subscribers)]
+        await _until(lambda: len(broadcaster.stats()["subscribers"]) >= before + subscribers, 30, "SSE subscribers")
+        await fake.stream(count, rate, bench_ts=True, ids=ids)
+        expected = count * subscribers
+        try:
+            await _until(lambda: received[0] >= expected, 60, "SSE delivery")
+        except TimeoutError:
+            pass  # coalescing/drops under overload are reported via "delivered"
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return {"subscribers": subscribers, "events": count, "target_rate": rate or "max",
+            "delivered": f"{received[0]}/{count * subscribers}", "latency_ms": _summary(latencies)}
+
+async def bench_commands(fake: FakeHA, base_url: str, count: int, concurrency: int) -> Dict[str, Any]:
+    ids = [eid for eid in fake.states if eid.startswith("light.")]
+    latencies: List[float] = []
+    errors = [0]
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(client: httpx.AsyncClient, n: int):
+        async with sem:
+            body = {"entity_id": ids[n % len(ids)], "properties": {"on": True, "brightness": 1 + n % 255}, "actor": "bench"}
+            t0 = time.perf_counter()
+            r = await client.post("/api/v1/command", json=body)
+            latencies.append(time.perf_counter() - t0)
+            if r.status_code != 200:
+                errors[0] += 1
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=30) as client:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(client, n) for n in range(count)))
+        total = time.perf_counter() - t0
+    return {"commands": count, "concurrency": concurrency, "errors": errors[0],
+            "per_sec": round(count / total, 1), "latency_ms": _summary(latencies)}
+
+async def main(args) -> Dict[str, Any]:
+    ha_port, bridge_port = _free_port(), _free_port()
+    tmp = tempfile.mkdtemp(prefix="bridge-bench-")
+    # settings are read at import time, so point the bridge at the fake before importing it
+    os.environ.update(HA_URL=f"http://127.0.0.1:{ha_port}", HA_TOKEN="bench", DB_URL=f"sqlite:///{tmp}/bench.db",
+                      LOG_LEVEL=os.environ.get("LOG_LEVEL", "WARNING"))
+    fake = FakeHA(args.entities)
+    ha_server, ha_task = await _serve(fake.app, ha_port)
+    report: Dict[str, Any] = {"entities": args.entities}
+    try:
+        report["full_sync"] = await bench_full_sync(fake, args.changed)
+
+        from app.main import app
+        from app.state import catalog
+        bridge, bridge_task = await _serve(app, bridge_port)
+        try:
+            await _until(lambda: fake.subscribed.is_set() and len(catalog.entities) >= args.entities, 60,
+                         "the bridge to sync and subscribe")
+            base_url = f"http://127.0.0.1:{bridge_port}"
+            report["ws_consumer"] = await bench_events(fake, args.events, args.rate)
+            report["sse_fanout"] = await bench_sse(fake, base_url, args.subscribers, args.sse_events, args.sse_rate)
+            report["commands"] = await bench_commands(fake, base_url, args.commands, args.concurrency)
+        finally:
+            bridge.should_exit = True
+            await bridge_task
+    finally:
+        ha_server.should_exit = True
+        await ha_task
+    return report
+
+def _print(report: Dict[str, Any]):
+    print(f"entities: {report['entities']}")
+    for section in ("full_sync", "ws_consumer", "sse_fanout", "commands"):
+        value = report.get(section)
+        if value is None:
+            continue
+        print(f"\n[{section}]")
+        for k, v in value.items():
+            print(f"  {k}: {orjson.dumps(v).decode() if isinstance(v, dict) else v}")
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(prog="python -m bench.run", description="Benchmark the bridge against a fake HA")
+    p.add_argument("--entities", type=int, default=5000)
+    p.add_argument("--changed", type=float, default=0.1, help="share of entities changed before the third full_sync")
+    p.add_argument("--events", type=int, default=20000, help="state_changed events for the throughput run")
+    p.add_argument("--rate", type=float, default=0, help="events/sec for the throughput run (0 = as fast as possible)")
+    p.add_argument("--subscribers", type=int, default=50, help="concurrent SSE clients")
+    p.add_argument("--sse-events", type=int, default=2000)
+    p.add_argument("--sse-rate", type=float, default=500)
+    p.add_argument("--commands", type=int, default=500)
+    p.add_argument("--concurrency", type=int, default=8)
+    p.add_argument("--json", action="store_true", help="print the report as JSON")
+    return p.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = asyncio.run(main(args))
+    if args.json:
+        sys.stdout.write(orjson.dumps(report, option=orjson.OPT_INDENT_2).decode() + "\n")
+    else:
+        _print(report)
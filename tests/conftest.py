@@ -0,0 +1,8 @@
+import os, sys, tempfile
+
+# settings are read at import time: point the app at a throwaway database and a dummy HA
+_tmp = tempfile.mkdtemp(prefix="bridge-tests-")
+os.environ.setdefault("HA_TOKEN", "test")
+os.environ.setdefault("HA_URL", "http://127.0.0.1:9")
+os.environ.setdefault("DB_URL", f"sqlite:///{_tmp}/bridge.db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,16 @@
+from datetime import datetime, timedelta, timezone
+from app.audit import insert_records, query_records
+from app.persist import init_schema
+
+def test_aware_bounds_match_naive_utc_rows():
+    init_schema()
+    ts = datetime(2026, 3, 1, 12, 0)  # stored naive UTC
+    insert_records([{"id": "a1", "ts": ts, "actor": "tz-test", "action": "set_properties",
+                     "target_type": "entity", "target_id": "light.a", "payload": {}}])
+    cet = timezone(timedelta(hours=1))
+    # 12:30+01:00 is 11:30 UTC, before the row; 13:30+01:00 is 12:30 UTC, after it
+    rows = query_records("tz-test", None, None, datetime(2026, 3, 1, 12, 30, tzinfo=cet),
+                         datetime(2026, 3, 1, 13, 30, tzinfo=cet), None, 10)
+    assert [r["id"] for r in rows] == ["a1"]
+    after = (datetime(2026, 3, 1, 13, 0, tzinfo=cet), "zz")  # == the row's ts in UTC
+    assert [r["id"] for r in query_records("tz-test", None, None, None, None, after, 10)] == ["a1"]
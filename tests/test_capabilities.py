@@ -0,0 +1,25 @@
+from app.capabilities import CapabilityIndex
+
+LIGHT = {"entity_id": "light.desk", "domain": "light",
+         "attributes": {"supported_color_modes": ["color_temp", "hs"], "min_mireds": 153, "max_mireds": 500}}
+
+def _index(light_services):
+    index = CapabilityIndex()
+    index.set_services([{"domain": "light", "services": light_services}])
+    return index
+
+def test_sectioned_fields_are_flattened():
+    index = _index({
+        "turn_on": {"fields": {"transition": {"selector": {"number": {}}},
+                               "advanced_fields": {"collapsed": True, "fields": {
+                                   "brightness": {"selector": {"number": {}}},
+                                   "color_temp": {"selector": {"color_temp": {}}},
+                                   "hs_color": {}}}}},
+        "turn_off": {"fields": {}},
+    })
+    assert index.services["light"]["turn_on"] == {"transition", "brightness", "color_temp", "hs_color"}
+    assert set(index.get(LIGHT)) == {"on", "brightness", "color_temp", "hs_color"}
+
+def test_flat_fields_still_index():
+    index = _index({"turn_on": {"fields": {"brightness": {}}}, "turn_off": {"fields": {}}})
+    assert set(index.get(LIGHT)) == {"on", "brightness"}
@@ -0,0 +1,79 @@
+import asyncio
+import pytest
+from app import commands
+from app.commands import plan_calls
+
+def _steps(steps):
+    return [[f"{c['domain']}.{c['service']}" for c in calls] for calls in steps]
+
+def test_fan_percentage_folds_into_turn_on():
+    steps = plan_calls("fan.ceiling", {"percentage": 40, "on": True})
+    assert steps == [[{"domain": "fan", "service": "turn_on", "data": {"percentage": 40, "entity_id": "fan.ceiling"}}]]
+
+def test_climate_hvac_mode_folds_into_set_temperature():
+    [[call]] = plan_calls("climate.hall", {"temperature": 21, "hvac_mode": "heat"})
+    assert call["service"] == "set_temperature"
+    assert call["data"] == {"temperature": 21.0, "hvac_mode": "heat", "entity_id": "climate.hall"}
+
+def test_toggle_runs_before_dependent_calls():
+    assert _steps(plan_calls("cover.blind", {"position": 30, "open": True})) == \
+        [["cover.open_cover"], ["cover.set_cover_position"]]
+    assert _steps(plan_calls("media_player.tv", {"volume_level": 0.3, "playing": True, "on": True})) == \
+        [["media_player.turn_on"], ["media_player.media_play"], ["media_player.volume_set"]]
+
+def test_independent_calls_share_a_step():
+    assert _steps(plan_calls("climate.hall", {"fan_mode": "low", "temperature": 21})) == \
+        [["climate.set_temperature", "climate.set_fan_mode"]]
+    assert _steps(plan_calls("media_player.tv", {"source": "HDMI", "volume_level": 0.3})) == \
+        [["media_player.volume_set", "media_player.select_source"]]
+
+def test_fan_off_is_not_folded():
+    assert _steps(plan_calls("fan.ceiling", {"on": False, "oscillating": True})) == [["fan.turn_off"], ["fan.oscillate"]]
+
+@pytest.fixture
+def ha_calls(monkeypatch):
+    log = []
+
+    async def call_service(domain, service, data):
+        log.append(("start", service, data["entity_id"]))
+        # the first step is the slowest: racing calls would let the second one finish first
+        await asyncio.sleep(0.02 if service == "turn_on" else 0)
+        log.append(("end", service, data["entity_id"]))
+        return []
+    monkeypatch.setattr(commands, "call_service", call_service)
+    monkeypatch.setattr(commands, "_audit", lambda *a, **k: None)
+    return log
+
+def test_execute_calls_runs_in_plan_order(ha_calls):
+    steps = plan_calls("media_player.tv", {"volume_level": 0.3, "on": True})
+    asyncio.run(commands.execute_calls(steps))
+    assert [(e, s) for e, s, _ in ha_calls] == [("start", "turn_on"), ("end", "turn_on"),
+                                                ("start", "volume_set"), ("end", "volume_set")]
+
+def test_execute_calls_runs_a_step_concurrently(ha_calls):
+    steps = plan_calls("media_player.tv", {"source": "HDMI", "volume_level": 0.3})
+    asyncio.run(commands.execute_calls(steps))
+    assert [e for e, _, _ in ha_calls] == ["start", "start", "end", "end"]
+
+def test_run_batch_orders_steps_per_entity(ha_calls):
+    entries = [{"entity_id": f"media_player.tv{i}", "properties": {"on": True, "volume_level": 0.5}} for i in range(2)]
+
+    async def collect():
+        return [r async for r in commands.run_batch(entries)]
+    results = asyncio.run(collect())
+    assert sorted(r["index"] for r in results) == [0, 1]
+    assert all(r["status"] == "ok" for r in results)
+    # one grouped turn_on for both entities, then one grouped volume_set
+    assert [(e, s) for e, s, _ in ha_calls] == [("start", "turn_on"), ("end", "turn_on"),
+                                                ("start", "volume_set"), ("end", "volume_set")]
+    assert ha_calls[0][2] == ["media_player.tv0", "media_player.tv1"]
+
+def test_run_batch_answers_entries_without_properties(ha_calls):
+    entries = [{"entity_id": "light.a", "properties": {}}, {"entity_id": "light.b", "properties": {"on": True}}]
+
+    async def collect():
+        return [r async for r in commands.run_batch(entries)]
+    results = sorted(asyncio.run(collect()), key=lambda r: r["index"])
+    assert results[0] == {"index": 0, "entity_id": "light.a", "status": "ok", "results": []}
+    assert results[1]["status"] == "ok"
+    assert [c[2] for c in ha_calls if c[0] == "start"] == [["light.b"]]
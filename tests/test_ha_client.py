@@ -0,0 +1,61 @@
+import asyncio
+import pytest
+from app import ha_client
+from app.ha_client import WSConnectionLost, WSUnavailable, call_service
+
+class _Socket:
+    def __init__(self, fail_send=False):
+        self.sent = []
+        self.fail_send = fail_send
+
+    async def send(self, text):
+        if self.fail_send:
+            from websockets.exceptions import ConnectionClosed
+            raise ConnectionClosed(None, None)
+        self.sent.append(text)
+
+@pytest.fixture
+def rest_calls(monkeypatch):
+    calls = []
+
+    async def rest_post(path, data):
+        calls.append((path, data))
+        return []
+    monkeypatch.setattr(ha_client, "rest_post", rest_post)
+    yield calls
+    ha_client._ws = None
+    ha_client._pending.clear()
+
+def test_call_service_lost_after_send_is_not_retried_over_rest(rest_calls):
+    async def scenario():
+        ha_client._ws = _Socket()
+        task = asyncio.create_task(call_service("light", "turn_on", {"entity_id": "light.a"}))
+        while not ha_client._pending:
+            await asyncio.sleep(0)
+        ha_client._fail_pending(WSConnectionLost("dropped"))
+        with pytest.raises(WSConnectionLost):
+            await task
+    asyncio.run(scenario())
+    assert rest_calls == []
+
+def test_call_service_falls_back_to_rest_when_send_fails(rest_calls):
+    async def scenario():
+        ha_client._ws = _Socket(fail_send=True)
+        await call_service("light", "turn_on", {"entity_id": "light.a"})
+    asyncio.run(scenario())
+    assert rest_calls == [("/api/services/light/turn_on", {"entity_id": "light.a"})]
+
+def test_call_service_falls_back_to_rest_without_socket(rest_calls):
+    asyncio.run(call_service("switch", "turn_off", {"entity_id": "switch.b"}))
+    assert rest_calls == [("/api/services/switch/turn_off", {"entity_id": "switch.b"})]
+    assert not issubclass(WSConnectionLost, WSUnavailable)
+
+def test_ws_timeout_names_the_service(rest_calls, monkeypatch):
+    monkeypatch.setattr(ha_client.settings, "HA_WS_TIMEOUT", 0.01)
+
+    async def scenario():
+        ha_client._ws = _Socket()
+        with pytest.raises(asyncio.TimeoutError, match=r"no result for light.turn_on within 0.01s"):
+            await call_service("light", "turn_on", {"entity_id": "light.a"})
+    asyncio.run(scenario())
+    assert rest_calls == []
@@ -0,0 +1,25 @@
+import asyncio
+from app import history
+from app.history import HistoryStore, read_rollup, write_batch
+from app.persist import init_schema
+
+def test_redelivered_points_are_not_counted_twice():
+    init_schema()
+    points = [("sensor.redelivered", 1_700_000_000.0, 20.0), ("sensor.redelivered", 1_700_000_010.0, 22.0)]
+    assert write_batch(points) == 2
+    assert write_batch(points + [("sensor.redelivered", 1_700_000_020.0, 24.0)]) == 1
+    [bucket] = read_rollup("sensor.redelivered", 3600, 1_699_999_200.0, 1_700_003_600.0).values()
+    assert bucket == [20.0, 24.0, 66.0, 3]
+
+def test_failed_flush_keeps_the_points(monkeypatch):
+    store = HistoryStore()
+    store.record("sensor.retry", "1.5", "2026-03-01T12:00:00+00:00")
+
+    async def failing(fn, *args):
+        raise OSError("disk full")
+    monkeypatch.setattr(history.db_worker, "run", failing)
+    asyncio.run(store.flush())
+    store.record("sensor.retry", "2.5", "2026-03-01T12:00:05+00:00")
+    store.record("sensor.retry", "1.5", "2026-03-01T12:00:00+00:00")  # re-delivered
+    assert [v for _, _, v in store._raw] == [1.5, 2.5]
+    assert store._acc[("sensor.retry", 60, 1772366400)] == [1.5, 2.5, 4.0, 2]
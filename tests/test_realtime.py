@@ -0,0 +1,21 @@
+import asyncio
+from app.realtime import Frame, Subscriber
+
+def _frame(entity_id, n):
+    return Frame({"event": "state", "data": {"entity_id": entity_id, "state": n}}, event_id=f"e.{n}")
+
+def _drain(sub):
+    async def scenario():
+        return [await sub.get() for _ in range(len(sub._items))]
+    return asyncio.run(scenario())
+
+def test_coalesce_keeps_the_slot_and_event_id():
+    sub = Subscriber(10, "coalesce")
+    sub.push(_frame("light.busy", 1))
+    sub.push(_frame("light.quiet", 2))
+    sub.push(_frame("light.busy", 3))
+    frames = _drain(sub)
+    assert [(f.entity_id, f.event["data"]["state"], f.event_id) for f in frames] == [
+        ("light.busy", 3, "e.1"), ("light.quiet", 2, "e.2")]
+    assert b'"id":"e.1"' in frames[0].json
+    assert sub.coalesced == 1
@@ -0,0 +1,54 @@
+import asyncio
+from app import state
+from app.db import SessionLocal
+from app.models import Entity
+from app.state import Catalog
+
+STATES = [{"entity_id": "light.placed", "state": "on", "attributes": {"friendly_name": "Placed"}}]
+
+def _sync(monkeypatch, catalog, states=STATES, **kwargs):
+    async def list_states():
+        return states
+
+    async def list_services():
+        return []
+    monkeypatch.setattr(state, "list_states", list_states)
+    monkeypatch.setattr(state, "list_services", list_services)
+    return asyncio.run(catalog.full_sync(**kwargs))
+
+def test_registry_before_first_sync_is_persisted(monkeypatch):
+    catalog = Catalog()
+    asyncio.run(catalog.init_db())
+    asyncio.run(catalog.apply_registry("entity_registry/list", [
+        {"entity_id": "light.placed", "device_id": "dev1", "area_id": "office", "platform": "hue"}]))
+    _sync(monkeypatch, catalog)
+    with SessionLocal() as s:
+        row = s.get(Entity, "light.placed")
+        assert (row.device_id, row.area_id, row.platform) == ("dev1", "office", "hue")
+
+def test_full_sync_publishes_changes_against_the_warm_store(monkeypatch):
+    catalog = Catalog()
+    catalog._put("light.stale", state.entity_view("light.stale", "on", {"brightness": 10, "effect": "loop"}))
+    published = []
+
+    async def broadcast(event, area_id=None, delta=None, trace=None):
+        published.append((event, delta))
+    _sync(monkeypatch, catalog, [{"entity_id": "light.stale", "state": "on", "attributes": {"brightness": 99}}],
+          broadcast_cb=broadcast)
+    [(event, delta)] = published
+    assert event["data"]["attributes"] == {"brightness": 99}
+    assert delta["data"]["set"] == {"brightness": 99} and delta["data"]["unset"] == ["effect"]
+
+def test_registry_snapshot_survives_a_failed_write(monkeypatch):
+    catalog = Catalog()
+
+    async def failing(fn, *args):
+        raise OSError("disk I/O error")
+    monkeypatch.setattr(state.db_worker, "run", failing)
+    msg = {"type": "result", "command": "area_registry/list", "success": True,
+           "result": [{"area_id": "office", "name": "Office"}]}
+
+    async def broadcast(*args, **kwargs):
+        pass
+    assert asyncio.run(catalog._handle_message(msg, broadcast)) == "registry_list"
+    assert catalog.areas == {"office": {"area_id": "office", "name": "Office"}}
@@ -0,0 +1,65 @@
+import asyncio
+from starlette.websockets import WebSocketDisconnect
+from app import ws_api
+from app.realtime import broadcaster
+from app.ws_api import ClientConnection
+
+class _WS:
+    def __init__(self, fail=False):
+        self.sent = []
+        self.fail = fail
+
+    async def send_text(self, text):
+        if self.fail:
+            raise WebSocketDisconnect(1006)
+        self.sent.append(ws_api.orjson.loads(text))
+
+def _handle(msg, ws=None):
+    ws = ws or _WS()
+    conn = ClientConnection(ws, "json")
+
+    async def scenario():
+        await conn.handle(msg)
+        await asyncio.gather(*conn.tasks)
+    asyncio.run(scenario())
+    conn.close()
+    return ws.sent
+
+def test_non_object_message_is_rejected():
+    assert _handle(["subscribe"]) == [{"type": "result", "success": False, "error": "Message must be an object"}]
+
+def test_filters_must_be_string_lists():
+    before = len(broadcaster.stats()["subscribers"])
+    [reply] = _handle({"id": 1, "type": "subscribe", "entity_ids": "light.kitchen"})
+    assert reply == {"id": 1, "type": "result", "success": False, "error": "entity_ids must be a list of strings"}
+    assert len(broadcaster.stats()["subscribers"]) == before
+
+def test_command_properties_must_be_an_object():
+    [reply] = _handle({"id": 2, "type": "command", "entity_id": "light.a", "properties": ["on"]})
+    assert reply["id"] == 2 and reply["success"] is False
+
+def test_pump_stops_quietly_when_the_client_is_gone():
+    conn = ClientConnection(_WS(fail=True), "json")
+
+    async def scenario():
+        sid = conn.subscribe({})
+        sub = conn.subs[sid]
+        sub.push(ws_api.Frame({"data": {"entity_id": "light.a"}}, event_id="e.1"))
+        await asyncio.wait_for(conn.pumps[sid], 1)
+        return conn.pumps[sid].exception()
+    assert asyncio.run(scenario()) is None
+    conn.close()
+
+def test_overflow_disconnect_unsubscribes():
+    ws = _WS()
+    conn = ClientConnection(ws, "json")
+
+    async def scenario():
+        sid = conn.subscribe({"overflow": "disconnect"})
+        conn.subs[sid].close()
+        await asyncio.wait_for(conn.pumps[sid], 1)
+        return sid
+    sid = asyncio.run(scenario())
+    conn.close()
+    assert sid not in broadcaster._subs
+    assert ws.sent == [{"type": "subscription_closed", "subscription": sid}]